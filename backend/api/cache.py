@@ -0,0 +1,165 @@
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    patch_vary_headers,
+)
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+GENERATION_KEY = 'generation:{}'
+RESPONSE_KEY = 'response:{}'
+
+
+def get_generations(*scopes):
+    keys = [GENERATION_KEY.format(scope) for scope in scopes]
+    generations = cache.get_many(keys)
+    missing = [key for key in keys if key not in generations]
+    if missing:
+        now = time.time_ns()
+        for key in missing:
+            if not cache.add(key, now, None):
+                now = cache.get(key, now)
+            generations[key] = now
+    return [generations[key] for key in keys]
+
+
+def get_generation(scope):
+    return get_generations(scope)[0]
+
+
+def bump_generation(*scopes):
+    keys = [GENERATION_KEY.format(scope) for scope in scopes]
+    current = cache.get_many(keys)
+    now = time.time_ns()
+    cache.set_many(
+        {key: max(now, current.get(key, 0) + 1) for key in keys}, None
+    )
+
+
+def bump_generation_on_commit(*scopes):
+    transaction.on_commit(lambda: bump_generation(*scopes))
+
+
+class CachedResponseMixin:
+    """Caches list/retrieve responses for anonymous users.
+
+    The key is built from the path, the whitelisted query parameters and
+    the current generation of every scope from `get_cache_scopes()`, so a
+    bumped generation makes the old entries unreachable.
+    """
+    cache_scopes = ()
+    cache_params = ()
+
+    def get_cache_scopes(self):
+        return self.cache_scopes
+
+    def get_cache_key(self, request):
+        params = request.query_params
+        if not set(params) <= set(self.cache_params):
+            return None
+        normalized = sorted(
+            (name, sorted(params.getlist(name))) for name in params
+        )
+        generations = get_generations(*self.get_cache_scopes())
+        raw = json.dumps([request.path, normalized, generations])
+        return RESPONSE_KEY.format(hashlib.sha256(raw.encode()).hexdigest())
+
+    def get_cached_response(self, handler, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return handler(request, *args, **kwargs)
+        key = self.get_cache_key(request)
+        if key is None:
+            return handler(request, *args, **kwargs)
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, settings.RESPONSE_CACHE_TIMEOUT)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            super().list, request, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            super().retrieve, request, *args, **kwargs
+        )
+
+
+class ConditionalGetMixin:
+    """Answers list/retrieve with ETag and Last-Modified validators.
+
+    The validators are derived from the scope generations (plus the
+    requesting user's own scope) and `get_validator_data()`, so a
+    matching If-None-Match or If-Modified-Since returns 304 before the
+    queryset is touched or anything is serialized. Last-Modified is only
+    sent once its second is over.
+    """
+    cache_scopes = ()
+
+    def get_cache_scopes(self):
+        return self.cache_scopes
+
+    def get_validator_data(self, request):
+        return None, None
+
+    def get_validators(self, request):
+        scopes = list(self.get_cache_scopes())
+        if request.user.is_authenticated:
+            scopes.append(f'user:{request.user.pk}')
+        generations = get_generations(*scopes)
+        data, modified = self.get_validator_data(request)
+        last_modified = max(generations, default=0) / 10 ** 9
+        if modified is not None:
+            last_modified = max(last_modified, modified.timestamp())
+        raw = json.dumps([
+            request.path,
+            sorted(request.query_params.lists()),
+            request.accepted_media_type,
+            request.user.pk,
+            generations,
+            data,
+        ], default=str)
+        etag = quote_etag(hashlib.sha256(raw.encode()).hexdigest()[:32])
+        return etag, int(last_modified)
+
+    def get_conditional_response(self, handler, request, *args, **kwargs):
+        etag, last_modified = self.get_validators(request)
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if time.time() >= last_modified + 1:
+                # Last-Modified has one-second resolution: sent within
+                # that second, a later change in the same second would
+                # still match If-Modified-Since.
+                response['Last-Modified'] = http_date(last_modified)
+            if request.user.is_authenticated:
+                patch_cache_control(response, no_cache=True, private=True)
+            else:
+                patch_cache_control(response, no_cache=True)
+            patch_vary_headers(response, ('Accept', 'Authorization'))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.get_conditional_response(
+            super().list, request, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_conditional_response(
+            super().retrieve, request, *args, **kwargs
+        )
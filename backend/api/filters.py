@@ -1,5 +1,6 @@
 import django_filters as filters
-from recipe.models import Recipe, Tag, Ingredient
+from recipe.models import Recipe, Tag
+from recipe.search import search_recipes
 
 
 class RecipeFilter(filters.FilterSet):
@@ -10,13 +11,27 @@ class RecipeFilter(filters.FilterSet):
         method='is_in_shopping_cart_filter'
     )
     author = filters.CharFilter(field_name='author_id')
+    search = filters.CharFilter(method='search_filter')
     tags = filters.ModelMultipleChoiceFilter(
-        field_name='tags__slug',
         to_field_name='slug',
         queryset=Tag.objects.all(),
-
+        method='tags_filter',
+    )
+    tags_all = filters.ModelMultipleChoiceFilter(
+        to_field_name='slug',
+        queryset=Tag.objects.all(),
+        method='tags_all_filter',
     )
 
+    def tags_filter(self, queryset, name, value):
+        return queryset.filter_tags(value)
+
+    def tags_all_filter(self, queryset, name, value):
+        return queryset.filter_tags(value, match_all=True)
+
+    def search_filter(self, queryset, name, value):
+        return search_recipes(queryset, value)
+
     def is_favorited_filter(self, queryset, name, value):
         user = self.request.user
         if not value or user.is_anonymous:
@@ -35,13 +50,7 @@ class RecipeFilter(filters.FilterSet):
             'is_favorited',
             'is_in_shopping_cart',
             'author',
-            'tags'
+            'tags',
+            'tags_all',
+            'search',
         )
-
-
-class IngredientFilter(filters.FilterSet):
-    name = filters.CharFilter(lookup_expr='istartswith')
-
-    class Meta:
-        model = Ingredient
-        fields = ('name',)
@@ -0,0 +1,365 @@
+import atexit
+import fcntl
+import json
+import os
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.db import connections
+
+PREFIX = 'foodgram_http'
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+UNMATCHED = 'unmatched'
+RETIRED = 'retired.json'
+RETIRED_LOCK = 'retired.lock'
+
+
+class Series:
+    """Totals of one route/method/status combination."""
+    __slots__ = ('count', 'seconds', 'latency', 'db_seconds', 'queries',
+                 'query_counts', 'bytes')
+
+    def __init__(self, data=None):
+        data = data or {}
+        self.count = data.get('count', 0)
+        self.seconds = data.get('seconds', 0.0)
+        self.latency = data.get('latency') or [0] * len(LATENCY_BUCKETS)
+        self.db_seconds = data.get('db_seconds', 0.0)
+        self.queries = data.get('queries', 0)
+        self.query_counts = (
+            data.get('query_counts') or [0] * len(QUERY_BUCKETS)
+        )
+        self.bytes = data.get('bytes', 0)
+
+    def observe(self, seconds, db_seconds, queries, size):
+        self.count += 1
+        self.seconds += seconds
+        self.db_seconds += db_seconds
+        self.queries += queries
+        self.bytes += size
+        add(self.latency, LATENCY_BUCKETS, seconds)
+        add(self.query_counts, QUERY_BUCKETS, queries)
+
+    def merge(self, other):
+        self.count += other.count
+        self.seconds += other.seconds
+        self.db_seconds += other.db_seconds
+        self.queries += other.queries
+        self.bytes += other.bytes
+        self.latency = [a + b for a, b in zip(self.latency, other.latency)]
+        self.query_counts = [
+            a + b for a, b in zip(self.query_counts, other.query_counts)
+        ]
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def add(counts, buckets, value):
+    """Counts `value` in its bucket; cumulated only when rendering."""
+    for index, bound in enumerate(buckets):
+        if value <= bound:
+            counts[index] += 1
+            return
+
+
+class Registry:
+    """Per-process metrics, periodically dumped to METRICS_DIR.
+
+    Every gunicorn worker owns one file named after its pid and a random
+    id, so a restarted worker never overwrites the totals of its
+    predecessor and the sum over all files stays monotonic; the files of
+    exited processes are folded into RETIRED. Requests only touch a dict
+    under a lock; the file is rewritten at most once per
+    METRICS_FLUSH_INTERVAL.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.series = {}
+        self.flushed = 0
+        self.pid = None
+        self.path = None
+
+    def observe(self, route, method, status, *values):
+        key = (route, method, str(status))
+        with self.lock:
+            self.check_fork()
+            if key not in self.series:
+                self.series[key] = Series()
+            self.series[key].observe(*values)
+        if time.monotonic() - self.flushed >= settings.METRICS_FLUSH_INTERVAL:
+            self.flush()
+
+    def check_fork(self):
+        # A forked worker must not keep or rewrite its parent's numbers.
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.series = {}
+            self.path = None
+
+    def get_path(self):
+        if self.path is None and settings.METRICS_DIR:
+            self.path = os.path.join(
+                settings.METRICS_DIR, f'{self.pid}-{uuid.uuid4().hex}.json'
+            )
+        return self.path
+
+    def snapshot(self):
+        with self.lock:
+            self.check_fork()
+            return {
+                '|'.join(key): series.as_dict()
+                for key, series in self.series.items()
+            }
+
+    def flush(self):
+        if not self.flush_lock.acquire(blocking=False):
+            return
+        try:
+            self.flushed = time.monotonic()
+            data = self.snapshot()
+            path = self.get_path()
+            if path is None or not data:
+                return
+            os.makedirs(settings.METRICS_DIR, exist_ok=True)
+            temporary = f'{path}.tmp'
+            with open(temporary, 'w') as metrics_file:
+                json.dump(data, metrics_file)
+            os.replace(temporary, path)
+        finally:
+            self.flush_lock.release()
+
+    def collect(self):
+        """Totals of every process that has flushed, this one included."""
+        self.flush()
+        if not settings.METRICS_DIR:
+            return merged([self.snapshot()])
+        try:
+            names = os.listdir(settings.METRICS_DIR)
+        except FileNotFoundError:
+            names = []
+        dumps = []
+        exited = []
+        for name in names:
+            if not name.endswith('.json') or name == RETIRED:
+                continue
+            pid = name.partition('-')[0]
+            if pid.isdigit() and not is_running(int(pid)):
+                exited.append(name)
+                continue
+            dumps.append(read_dump(name))
+        if exited:
+            retire(exited)
+        return merged(dumps + [read_dump(RETIRED)])
+
+
+def read_dump(name):
+    try:
+        with open(os.path.join(settings.METRICS_DIR, name)) as metrics_file:
+            return json.load(metrics_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def merged(dumps):
+    totals = {}
+    for dump in dumps:
+        for key, data in dump.items():
+            key = tuple(key.split('|'))
+            if key not in totals:
+                totals[key] = Series()
+            totals[key].merge(Series(data))
+    return totals
+
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def retire(names):
+    """Folds the files of exited processes into RETIRED and removes them.
+
+    Their totals stay in the sums, so counters never go down, while the
+    number of files no longer grows with every worker restart.
+    """
+    with open(os.path.join(settings.METRICS_DIR, RETIRED_LOCK), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        names = [
+            name for name in names
+            if os.path.exists(os.path.join(settings.METRICS_DIR, name))
+        ]
+        if not names:
+            return
+        totals = merged([read_dump(RETIRED)] + list(map(read_dump, names)))
+        path = os.path.join(settings.METRICS_DIR, RETIRED)
+        with open(f'{path}.tmp', 'w') as metrics_file:
+            json.dump({
+                '|'.join(key): series.as_dict()
+                for key, series in totals.items()
+            }, metrics_file)
+        os.replace(f'{path}.tmp', path)
+        for name in names:
+            os.remove(os.path.join(settings.METRICS_DIR, name))
+
+
+registry = Registry()
+atexit.register(registry.flush)
+
+
+class QueryTimer:
+    """`execute_wrapper` hook counting queries and their time."""
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.queries += 1
+
+
+class MetricsMiddleware:
+    """Records latency, DB time, query count and size per resolved route.
+
+    Streaming responses are measured when their content is exhausted or
+    closed, since that is when their queries run.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        timer = QueryTimer()
+        wrapped = []
+        for connection in connections.all():
+            connection.execute_wrappers.append(timer)
+            wrapped.append(connection)
+
+        def finish(status, size):
+            for connection in wrapped:
+                if timer in connection.execute_wrappers:
+                    connection.execute_wrappers.remove(timer)
+            match = request.resolver_match
+            registry.observe(
+                (match and match.url_name) or UNMATCHED,
+                request.method,
+                status,
+                time.perf_counter() - start,
+                timer.seconds,
+                timer.queries,
+                size,
+            )
+
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            finish(500, 0)
+            raise
+        if response.streaming:
+            response.streaming_content = MeasuredContent(
+                response.streaming_content,
+                lambda size: finish(response.status_code, size),
+            )
+        else:
+            finish(response.status_code, len(response.content))
+        return response
+
+
+class MeasuredContent:
+    """Streaming content that reports its size once it is done.
+
+    Django closes the content after sending it, even when it was never
+    iterated (HEAD, a dropped client), so `close` is where it finishes.
+    """
+
+    def __init__(self, chunks, finish):
+        self.chunks = chunks
+        self.finish = finish
+        self.size = 0
+        self.finished = False
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            self.size += len(chunk)
+            yield chunk
+
+    def close(self):
+        if not self.finished:
+            self.finished = True
+            self.finish(self.size)
+
+
+def escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def render():
+    """All series in the Prometheus text exposition format."""
+    totals = sorted(registry.collect().items())
+    lines = []
+
+    def header(name, kind, description):
+        lines.append(f'# HELP {PREFIX}_{name} {description}')
+        lines.append(f'# TYPE {PREFIX}_{name} {kind}')
+
+    def labels(key, **extra):
+        route, method, status = key
+        pairs = [('route', route), ('method', method), ('status', status)]
+        pairs += extra.items()
+        return ','.join(f'{name}="{escape(value)}"' for name, value in pairs)
+
+    def histogram(name, buckets, counts_of, sum_of):
+        for key, series in totals:
+            cumulative = 0
+            for bound, count in zip(buckets, counts_of(series)):
+                cumulative += count
+                lines.append(
+                    f'{PREFIX}_{name}_bucket{{{labels(key, le=str(bound))}}}'
+                    f' {cumulative}'
+                )
+            lines.append(
+                f'{PREFIX}_{name}_bucket{{{labels(key, le="+Inf")}}}'
+                f' {series.count}'
+            )
+            lines.append(f'{PREFIX}_{name}_sum{{{labels(key)}}} '
+                         f'{sum_of(series)}')
+            lines.append(f'{PREFIX}_{name}_count{{{labels(key)}}} '
+                         f'{series.count}')
+
+    def counter(name, value_of):
+        for key, series in totals:
+            lines.append(f'{PREFIX}_{name}{{{labels(key)}}} '
+                         f'{value_of(series)}')
+
+    header('request_duration_seconds', 'histogram',
+           'Request latency by route.')
+    histogram('request_duration_seconds', LATENCY_BUCKETS,
+              lambda series: series.latency, lambda series: series.seconds)
+    header('request_queries', 'histogram', 'SQL queries per request.')
+    histogram('request_queries', QUERY_BUCKETS,
+              lambda series: series.query_counts,
+              lambda series: series.queries)
+    header('db_duration_seconds_total', 'counter',
+           'Time spent in SQL queries.')
+    counter('db_duration_seconds_total', lambda series: series.db_seconds)
+    header('response_bytes_total', 'counter', 'Response body size.')
+    counter('response_bytes_total', lambda series: series.bytes)
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,11 @@
+from rest_framework.negotiation import DefaultContentNegotiation
+
+
+class FileDownloadNegotiation(DefaultContentNegotiation):
+    """Leaves `?format=` and Accept to a view that builds its own file.
+
+    The first renderer is only used for error responses.
+    """
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
@@ -0,0 +1,177 @@
+import base64
+import binascii
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(LimitOffsetPagination):
+    """Limit/offset pagination with an opt-in keyset (cursor) mode.
+
+    `?cursor=` (empty for the first page) switches to keyset mode, where
+    pages are selected with a WHERE on the `ordering` columns instead of
+    OFFSET. `?count=0` skips the COUNT(*) query in either mode.
+    """
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    ordering = ('id',)
+    invalid_cursor_message = 'Неверный курсор'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.limit = self.get_limit(request)
+        self.with_count = request.query_params.get(
+            self.count_query_param
+        ) not in ('0', 'false')
+        self.cursor_mode = self.cursor_query_param in request.query_params
+        if self.cursor_mode:
+            return self.paginate_keyset(queryset, request)
+        if self.with_count:
+            return super().paginate_queryset(queryset, request, view)
+        self.count = None
+        self.offset = self.get_offset(request)
+        rows = list(queryset[self.offset:self.offset + self.limit + 1])
+        self.has_next = len(rows) > self.limit
+        return rows[:self.limit]
+
+    def paginate_keyset(self, queryset, request):
+        position, reverse = self.decode_cursor(request, queryset.model)
+        self.count = queryset.count() if self.with_count else None
+        ordering = self.get_ordering(reverse)
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.keyset_filter(ordering, position))
+        rows = list(queryset[:self.limit + 1])
+        has_more = len(rows) > self.limit
+        rows = rows[:self.limit]
+        if reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        self.page = rows
+        return rows
+
+    def get_ordering(self, reverse=False):
+        if not reverse:
+            return self.ordering
+        return tuple(
+            name[1:] if name.startswith('-') else '-' + name
+            for name in self.ordering
+        )
+
+    def keyset_filter(self, ordering, position):
+        condition = Q()
+        equal = {}
+        for name, value in zip(ordering, position):
+            field = name.lstrip('-')
+            lookup = 'lt' if name.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{field}__{lookup}': value})
+            equal[field] = value
+        return condition
+
+    def encode_cursor(self, obj, reverse):
+        fields = [
+            obj._meta.get_field(name.lstrip('-')) for name in self.ordering
+        ]
+        payload = {
+            'p': [field.value_to_string(obj) for field in fields],
+            'r': int(reverse),
+        }
+        cursor = base64.urlsafe_b64encode(
+            json.dumps(payload, separators=(',', ':')).encode()
+        ).decode()
+        url = remove_query_param(
+            self.request.build_absolute_uri(), self.offset_query_param
+        )
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            fields = [
+                model._meta.get_field(name.lstrip('-'))
+                for name in self.ordering
+            ]
+            if len(payload['p']) != len(fields):
+                raise ValueError
+            position = [
+                field.to_python(value)
+                for field, value in zip(fields, payload['p'])
+            ]
+            return position, bool(payload['r'])
+        except (
+            binascii.Error, KeyError, TypeError, ValueError, ValidationError
+        ):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if self.cursor_mode:
+            if not (self.has_next and self.page):
+                return None
+            return self.encode_cursor(self.page[-1], reverse=False)
+        if self.count is not None:
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        return replace_query_param(
+            url, self.offset_query_param, self.offset + self.limit
+        )
+
+    def get_previous_link(self):
+        if self.cursor_mode:
+            if not (self.has_previous and self.page):
+                return None
+            return self.encode_cursor(self.page[0], reverse=True)
+        if self.count is not None:
+            return super().get_previous_link()
+        if self.offset <= 0:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        if self.offset - self.limit <= 0:
+            return remove_query_param(url, self.offset_query_param)
+        return replace_query_param(
+            url, self.offset_query_param, self.offset - self.limit
+        )
+
+    def get_paginated_response(self, data):
+        content = OrderedDict()
+        if self.count is not None:
+            content['count'] = self.count
+        content['next'] = self.get_next_link()
+        content['previous'] = self.get_previous_link()
+        content['results'] = data
+        return Response(content)
+
+
+class RecipePagination(KeysetPagination):
+    ordering = ('-pub_date', '-id')
+
+
+class FeedPagination(RecipePagination):
+    """Keyset pages only, without COUNT(*) unless `?count=1`."""
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.limit = self.get_limit(request)
+        self.with_count = request.query_params.get(
+            self.count_query_param
+        ) in ('1', 'true')
+        self.cursor_mode = True
+        return self.paginate_keyset(queryset, request)
+
+
+class PantryPagination(LimitOffsetPagination):
+    max_limit = 100
@@ -1,8 +1,8 @@
 from django.urls import include, path
 from rest_framework import routers
-from api import views
 from users.views import UserViewSet
 from recipe.views import TagViewSet, IngredientViewSet, RecipeViewSet
+from api.views import metrics_view
 
 app_name = 'api'
 
@@ -14,6 +14,7 @@ router.register(r'recipes', RecipeViewSet, basename='recipes')
 
 
 urlpatterns = [
+    path('metrics', metrics_view, name='metrics'),
     path('', include(router.urls)),
     path('auth/', include('djoser.urls')),
     path('auth/', include('djoser.urls.authtoken')),
@@ -1,14 +1,170 @@
 import base64
-from django.core.files.base import ContentFile
+import binascii
+import json
+from tempfile import SpooledTemporaryFile
+
+from django import forms
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from PIL import Image
 from rest_framework import serializers
 
+from recipe.images import describe
+
+BASE64_CHUNK_SIZE = 64 * 1024
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'jpg', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'png', 'image/png'),
+    (b'GIF87a', 'gif', 'image/gif'),
+    (b'GIF89a', 'gif', 'image/gif'),
+)
+WHITESPACE = {ord(char): None for char in ' \t\r\n'}
+
+
+def sniff_image(header):
+    """Extension and MIME type of an image by its first bytes."""
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'webp', 'image/webp'
+    for signature, extension, content_type in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return extension, content_type
+    return None
+
+
+def parse_form_data(data, json_fields=()):
+    """Plain dict from multipart/form-data.
+
+    Repeated keys become lists; `json_fields` may also carry a JSON
+    document, which is how nested data such as ingredients is sent.
+    """
+    parsed = {}
+    for name, values in data.lists():
+        parsed[name] = values if len(values) > 1 else values[0]
+        if name not in json_fields or len(values) > 1:
+            continue
+        value = values[0]
+        if isinstance(value, str) and value.lstrip()[:1] in ('[', '{'):
+            try:
+                parsed[name] = json.loads(value)
+            except ValueError:
+                raise serializers.ValidationError({name: 'Неверный JSON'})
+        else:
+            parsed[name] = values
+    return parsed
+
+
+class StreamingImageFormField(forms.ImageField):
+    """Django's ImageField without copying the whole upload into memory.
+
+    The image is verified straight from the file object, and oversized
+    dimensions are rejected from the header before any pixels are read.
+    """
+
+    def to_python(self, data):
+        file_object = forms.FileField.to_python(self, data)
+        if file_object is None:
+            return None
+        try:
+            file_object.seek(0)
+            image = Image.open(file_object)
+            if image.width * image.height > settings.IMAGE_UPLOAD_MAX_PIXELS:
+                raise ValueError
+            image.verify()
+        except Exception as error:
+            raise forms.ValidationError(
+                self.error_messages['invalid_image'], code='invalid_image'
+            ) from error
+        file_object.image = image
+        file_object.content_type = Image.MIME.get(image.format)
+        extension = image.format.lower().replace('jpeg', 'jpg')
+        file_object.name = f'temp.{extension}'
+        file_object.seek(0)
+        return file_object
+
 
 class Base64ImageField(serializers.ImageField):
-    def to_internal_value(self, data):
-        if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
+    """Image from a `data:image/...;base64,` string or a multipart file.
+
+    Base64 is decoded in chunks into a spooled temporary file; the size
+    limit is checked before decoding and the format is taken from the
+    decoded bytes, never from the client's MIME type.
+    """
+    default_error_messages = {
+        'too_large': 'Размер изображения не должен превышать {max_size} байт',
+        'invalid_base64': 'Неверная строка base64',
+        'unknown_format': 'Неизвестный формат изображения',
+    }
 
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('_DjangoImageField', StreamingImageFormField)
+        super().__init__(*args, **kwargs)
 
+    def to_internal_value(self, data):
+        max_size = settings.IMAGE_UPLOAD_MAX_SIZE
+        if isinstance(data, str) and data.startswith('data:'):
+            start = data.find(';base64,', 0, 256)
+            if start < 0:
+                self.fail('invalid_base64')
+            start += len(';base64,')
+            if (len(data) - start) // 4 * 3 > max_size:
+                self.fail('too_large', max_size=max_size)
+            data = self.decode(data, start, max_size)
+        elif getattr(data, 'size', 0) > max_size:
+            self.fail('too_large', max_size=max_size)
         return super().to_internal_value(data)
+
+    def decode(self, data, start, max_size):
+        output = SpooledTemporaryFile(
+            max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE
+        )
+        size = 0
+        rest = ''
+        content_type = None
+        for position in range(start, len(data), BASE64_CHUNK_SIZE):
+            chunk = rest + data[
+                position:position + BASE64_CHUNK_SIZE
+            ].translate(WHITESPACE)
+            cut = len(chunk) // 4 * 4
+            chunk, rest = chunk[:cut], chunk[cut:]
+            try:
+                decoded = base64.b64decode(chunk, validate=True)
+            except binascii.Error:
+                output.close()
+                self.fail('invalid_base64')
+            if content_type is None:
+                sniffed = sniff_image(decoded[:16])
+                if sniffed is None:
+                    output.close()
+                    self.fail('unknown_format')
+                extension, content_type = sniffed
+            size += len(decoded)
+            output.write(decoded)
+        if rest or not size:
+            output.close()
+            self.fail('invalid_base64')
+        output.seek(0)
+        return UploadedFile(
+            output, name=f'temp.{extension}',
+            content_type=content_type, size=size,
+        )
+
+
+class ImageVariantsField(serializers.Field):
+    """Read-only map of resized variants of an image with srcset strings.
+
+    Reads `<image_field>` and `<image_field>_variants` from the source
+    object and falls back to the original until the variants are built.
+    """
+
+    def __init__(self, image_field='image', **kwargs):
+        self.image_field = image_field
+        kwargs.setdefault('source', '*')
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        return describe(
+            getattr(value, self.image_field),
+            getattr(value, f'{self.image_field}_variants'),
+            self.image_field,
+        )
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.http import require_GET
+
+from api import metrics
+
+
+@require_GET
+def metrics_view(request):
+    if not settings.METRICS_TOKEN or not constant_time_compare(
+        request.headers.get('Authorization', ''),
+        f'Bearer {settings.METRICS_TOKEN}',
+    ):
+        return HttpResponse(status=401)
+    return HttpResponse(
+        metrics.render(), content_type='text/plain; version=0.0.4'
+    )
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -32,10 +33,12 @@ INSTALLED_APPS = [
     'api',
     'users',
     'recipe',
+    'jobs',
     'import_export',
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -77,6 +80,24 @@ DATABASES = {
     }
 }
 
+# The cache generations (api.cache) are bumped by the job worker too, so
+# every process has to share this cache: one FileBasedCache directory
+# mounted into all containers, or a database/Redis backend.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.filebased.FileBasedCache'
+        ),
+        'LOCATION': os.getenv(
+            'CACHE_LOCATION',
+            os.path.join(tempfile.gettempdir(), 'foodgram_cache')
+        ),
+    }
+}
+
+RESPONSE_CACHE_TIMEOUT = int(os.getenv('RESPONSE_CACHE_TIMEOUT', 60 * 5))
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -113,6 +134,66 @@ MEDIA_URL = '/media/'
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+JOBS_WORKERS = int(os.getenv('JOBS_WORKERS', 2))
+
+JOBS_POLL_INTERVAL = float(os.getenv('JOBS_POLL_INTERVAL', 1))
+
+JOBS_RETRY_DELAY = int(os.getenv('JOBS_RETRY_DELAY', 10))
+
+JOBS_TIMEOUT = int(os.getenv('JOBS_TIMEOUT', 60 * 10))
+
+JOBS_KEEP_DONE = int(os.getenv('JOBS_KEEP_DONE', 60 * 60 * 24))
+
+IMAGE_UPLOAD_MAX_SIZE = int(os.getenv('IMAGE_UPLOAD_MAX_SIZE', 10 * 1024 * 1024))
+
+IMAGE_UPLOAD_MAX_PIXELS = int(os.getenv('IMAGE_UPLOAD_MAX_PIXELS', 40_000_000))
+
+IMAGE_DELETE_ORIGINALS = os.getenv(
+    'IMAGE_DELETE_ORIGINALS', ''
+).lower() in ('1', 'true', 'yes')
+
+SHOPPING_LIST_FONT = os.getenv(
+    'SHOPPING_LIST_FONT', '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
+
+FEED_LENGTH = int(os.getenv('FEED_LENGTH', 500))
+
+FEED_TRIM_SLACK = int(os.getenv('FEED_TRIM_SLACK', 50))
+
+FEED_FANOUT_LIMIT = int(os.getenv('FEED_FANOUT_LIMIT', 10000))
+
+FEED_BATCH_SIZE = int(os.getenv('FEED_BATCH_SIZE', 1000))
+
+SHORT_LINK_LRU_SIZE = int(os.getenv('SHORT_LINK_LRU_SIZE', 10000))
+
+SHORT_LINK_MISSING_TIMEOUT = int(os.getenv('SHORT_LINK_MISSING_TIMEOUT', 60))
+
+SIMILAR_RECIPES_COUNT = int(os.getenv('SIMILAR_RECIPES_COUNT', 10))
+
+SIMILAR_MAX_SHARE = float(os.getenv('SIMILAR_MAX_SHARE', 0.1))
+
+SIMILAR_MAX_COUNT_FLOOR = int(os.getenv('SIMILAR_MAX_COUNT_FLOOR', 100))
+
+SIMILAR_FALLBACK_CANDIDATES = int(
+    os.getenv('SIMILAR_FALLBACK_CANDIDATES', 100)
+)
+
+SIMILAR_TAG_WEIGHT = float(os.getenv('SIMILAR_TAG_WEIGHT', 0.5))
+
+SIMILAR_MAX_CANDIDATES = int(os.getenv('SIMILAR_MAX_CANDIDATES', 200))
+
+SIMILAR_CHUNK_SIZE = int(os.getenv('SIMILAR_CHUNK_SIZE', 1000))
+
+PANTRY_REFRESH_INTERVAL = float(os.getenv('PANTRY_REFRESH_INTERVAL', 60))
+
+METRICS_DIR = os.getenv(
+    'METRICS_DIR', os.path.join(tempfile.gettempdir(), 'foodgram_metrics')
+)
+
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 5))
+
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'users.User'
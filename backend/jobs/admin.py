@@ -0,0 +1,15 @@
+from django.contrib import admin
+
+from jobs.models import Job
+
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = (
+        'id', 'name', 'status', 'attempts', 'run_at', 'finished_at'
+    )
+    list_filter = ('status', 'name')
+    search_fields = ('name', 'last_error')
+    readonly_fields = ('created_at', 'started_at', 'finished_at', 'worker')
+
+
+admin.site.register(Job, JobAdmin)
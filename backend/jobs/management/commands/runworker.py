@@ -0,0 +1,113 @@
+import os
+import signal
+import socket
+import time
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from jobs import queue
+
+MAINTENANCE_INTERVAL = 60
+
+
+class Command(BaseCommand):
+    help = 'Выполняет фоновые задачи из очереди'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=settings.JOBS_WORKERS,
+            help='Количество одновременно выполняемых задач',
+        )
+        parser.add_argument(
+            '--processes',
+            action='store_true',
+            help='Выполнять задачи в процессах, а не в потоках',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Выполнить готовые задачи и завершиться',
+        )
+        parser.add_argument(
+            '--stats',
+            action='store_true',
+            help='Показать состояние очереди и завершиться',
+        )
+        parser.add_argument(
+            '--stats-interval',
+            type=int,
+            default=MAINTENANCE_INTERVAL,
+            help='Как часто выводить состояние очереди, секунд (0 - никогда)',
+        )
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.write_stats()
+            return
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        workers = max(1, options['workers'])
+        if options['processes']:
+            connections.close_all()
+            executor = ProcessPoolExecutor(workers, initializer=django.setup)
+        else:
+            executor = ThreadPoolExecutor(
+                workers, thread_name_prefix='job-worker'
+            )
+        name = f'{socket.gethostname()}:{os.getpid()}'
+        self.stdout.write(f'{name}: обработчиков {workers}')
+        with executor:
+            self.loop(executor, name, workers, options)
+
+    def stop(self, signum, frame):
+        self.stopping = True
+
+    def loop(self, executor, name, workers, options):
+        running = set()
+        maintained = stats_written = 0
+        while not self.stopping:
+            now = time.monotonic()
+            if now - maintained >= MAINTENANCE_INTERVAL:
+                queue.requeue_stale()
+                queue.purge_done()
+                maintained = now
+            interval = options['stats_interval']
+            if interval and now - stats_written >= interval:
+                self.write_stats()
+                stats_written = now
+            free = workers - len(running)
+            claimed = queue.claim(name, free) if free else []
+            for pk in claimed:
+                running.add(executor.submit(queue.execute, pk))
+            if options['once'] and not claimed and not running:
+                break
+            if running:
+                done, running = wait(
+                    running,
+                    timeout=settings.JOBS_POLL_INTERVAL,
+                    return_when=FIRST_COMPLETED,
+                )
+            elif not claimed:
+                time.sleep(settings.JOBS_POLL_INTERVAL)
+        wait(running)
+        connections.close_all()
+
+    def write_stats(self):
+        stats = queue.stats()
+        self.stdout.write(' '.join(
+            f'{key}={value:.3f}' if isinstance(value, float)
+            else f'{key}={value}'
+            for key, value in stats.items()
+        ))
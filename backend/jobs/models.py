@@ -0,0 +1,45 @@
+from django.db import models
+from django.utils import timezone
+
+
+class Job(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (QUEUED, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Выполнена'),
+        (FAILED, 'Ошибка'),
+    )
+
+    name = models.CharField('Задача', max_length=200)
+    args = models.JSONField('Аргументы', default=list, blank=True)
+    kwargs = models.JSONField(
+        'Именованные аргументы', default=dict, blank=True,
+    )
+    status = models.CharField(
+        'Статус', max_length=16, choices=STATUSES, default=QUEUED,
+    )
+    attempts = models.PositiveSmallIntegerField('Попыток', default=0)
+    max_attempts = models.PositiveSmallIntegerField(
+        'Максимум попыток', default=5,
+    )
+    run_at = models.DateTimeField('Запустить после', default=timezone.now)
+    created_at = models.DateTimeField('Создана', auto_now_add=True)
+    started_at = models.DateTimeField('Начата', null=True, blank=True)
+    finished_at = models.DateTimeField('Завершена', null=True, blank=True)
+    worker = models.CharField('Обработчик', max_length=200, blank=True)
+    last_error = models.TextField('Последняя ошибка', blank=True)
+
+    class Meta:
+        verbose_name = 'фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+        ordering = ('id',)
+        indexes = [
+            models.Index(fields=('status', 'run_at')),
+        ]
+
+    def __str__(self):
+        return f'{self.name} #{self.pk}'
@@ -0,0 +1,176 @@
+import logging
+import random
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F, Min
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from jobs.models import Job
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+
+
+def job(func=None, *, max_attempts=5):
+    """Registers `func` as a job and adds `func.delay(*args, **kwargs)`.
+
+    `delay` only inserts a row, so inside a transaction the job becomes
+    visible to workers when (and if) that transaction commits.
+    """
+    def register(func):
+        name = f'{func.__module__}.{func.__qualname__}'
+        _registry[name] = func
+        func.job_name = name
+        func.delay = lambda *args, **kwargs: enqueue(
+            name, args, kwargs, max_attempts=max_attempts
+        )
+        return func
+    return register(func) if func is not None else register
+
+
+def get_job(name):
+    if name not in _registry:
+        import_string(name)
+    return _registry[name]
+
+
+def enqueue(name, args=(), kwargs=None, delay=0, max_attempts=5):
+    return Job.objects.create(
+        name=name,
+        args=list(args),
+        kwargs=kwargs or {},
+        max_attempts=max_attempts,
+        run_at=timezone.now() + timedelta(seconds=delay),
+    )
+
+
+def claim(worker, limit):
+    """Marks up to `limit` due jobs as running and returns their ids.
+
+    With SKIP LOCKED several workers share the queue without waiting on
+    each other; elsewhere (SQLite) each row is taken by a conditional
+    UPDATE and a lost race simply skips the row.
+    """
+    now = timezone.now()
+    due = Job.objects.filter(
+        status=Job.QUEUED, run_at__lte=now
+    ).order_by('run_at', 'id')
+    running = {
+        'status': Job.RUNNING,
+        'worker': worker,
+        'started_at': now,
+        'attempts': F('attempts') + 1,
+    }
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            pks = list(due.select_for_update(skip_locked=True).values_list(
+                'pk', flat=True
+            )[:limit])
+            Job.objects.filter(pk__in=pks).update(**running)
+        return pks
+    return [
+        pk for pk in due.values_list('pk', flat=True)[:limit]
+        if Job.objects.filter(pk=pk, status=Job.QUEUED).update(**running)
+    ]
+
+
+def retry_delay(attempts):
+    delay = settings.JOBS_RETRY_DELAY * 2 ** max(attempts - 1, 0)
+    return min(delay, 60 * 60) * random.uniform(1, 1.25)
+
+
+def execute(pk):
+    """Runs one claimed job and records the outcome."""
+    try:
+        try:
+            job = Job.objects.get(pk=pk)
+        except Job.DoesNotExist:
+            logger.warning('Задача %s удалена до запуска', pk)
+            return False
+        try:
+            get_job(job.name)(*job.args, **job.kwargs)
+        except Exception:
+            logger.exception('Задача %s завершилась ошибкой', job)
+            fail(job, traceback.format_exc())
+            return False
+        Job.objects.filter(pk=pk).update(
+            status=Job.DONE, finished_at=timezone.now(), last_error='',
+        )
+        return True
+    finally:
+        connection.close()
+
+
+def fail(job, error):
+    now = timezone.now()
+    if job.attempts < job.max_attempts:
+        changes = {
+            'status': Job.QUEUED,
+            'run_at': now + timedelta(seconds=retry_delay(job.attempts)),
+        }
+    else:
+        changes = {'status': Job.FAILED, 'finished_at': now}
+    Job.objects.filter(pk=job.pk).update(last_error=error, **changes)
+
+
+def requeue_stale():
+    """Returns jobs of crashed or stuck workers to the queue."""
+    now = timezone.now()
+    stale = Job.objects.filter(
+        status=Job.RUNNING,
+        started_at__lt=now - timedelta(seconds=settings.JOBS_TIMEOUT),
+    )
+    stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.FAILED, finished_at=now,
+        last_error='Превышено время выполнения',
+    )
+    return stale.update(status=Job.QUEUED, worker='')
+
+
+def purge_done():
+    finished = timezone.now() - timedelta(seconds=settings.JOBS_KEEP_DONE)
+    return Job.objects.filter(
+        status=Job.DONE, finished_at__lt=finished
+    ).delete()[0]
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def stats(window=60 * 60, sample=1000):
+    """Queue depth by status plus wait/run times of recent jobs."""
+    now = timezone.now()
+    result = dict.fromkeys((status for status, _ in Job.STATUSES), 0)
+    result.update(
+        Job.objects.values_list('status').annotate(Count('id')).order_by()
+    )
+    due = Job.objects.filter(status=Job.QUEUED, run_at__lte=now).aggregate(
+        count=Count('id'), oldest=Min('run_at')
+    )
+    result['due'] = due['count']
+    result['oldest_due_age'] = (
+        (now - due['oldest']).total_seconds() if due['oldest'] else 0
+    )
+    recent = Job.objects.filter(
+        status=Job.DONE, finished_at__gte=now - timedelta(seconds=window)
+    ).order_by('-finished_at').values_list(
+        'run_at', 'started_at', 'finished_at'
+    )[:sample]
+    waits = [(started - run_at).total_seconds()
+             for run_at, started, _ in recent]
+    runs = [(finished - started).total_seconds()
+            for _, started, finished in recent]
+    result['wait_p50'] = percentile(waits, 0.5)
+    result['wait_p95'] = percentile(waits, 0.95)
+    result['run_p50'] = percentile(runs, 0.5)
+    result['run_p95'] = percentile(runs, 0.95)
+    return result
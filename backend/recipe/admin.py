@@ -25,10 +25,22 @@ class IngredientAdmin(ImportExportModelAdmin):
     search_fields = ['name', ]
 
 
+class IngredientAmountAdmin(admin.ModelAdmin):
+
+    def delete_model(self, request, obj):
+        IngredientAmount.objects.write([obj.recipe_id], delete=[obj.pk])
+
+    def delete_queryset(self, request, queryset):
+        IngredientAmount.objects.write(
+            set(queryset.values_list('recipe_id', flat=True)),
+            delete=list(queryset.values_list('pk', flat=True)),
+        )
+
+
 admin.site.register(Tag)
 admin.site.register(Ingredient, IngredientAdmin)
 admin.site.register(Recipe)
-admin.site.register(IngredientAmount)
+admin.site.register(IngredientAmount, IngredientAmountAdmin)
 admin.site.register(Follow)
 admin.site.register(ShoppingCart)
 admin.site.register(Favorite)
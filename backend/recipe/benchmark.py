@@ -0,0 +1,537 @@
+import base64
+import io
+import itertools
+import json
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.test import Client
+from django.utils import timezone
+from PIL import Image
+from rest_framework.authtoken.models import Token
+
+from api.cache import bump_generation
+from api.metrics import QueryTimer
+from jobs.queue import percentile
+from recipe import search, shopping_list
+from recipe.counters import COUNTERS, rebuild_counter
+from recipe.ingredient_import import load_ingredients
+from recipe.models import (
+    Favorite,
+    Follow,
+    Ingredient,
+    IngredientAmount,
+    Recipe,
+    ShoppingCart,
+    Tag,
+    User,
+)
+
+USER_PREFIX = 'bench_'
+IMAGE_NAME = 'recipe/images/benchmark.png'
+PAGE_SIZE = 6
+DISHES = (
+    'Салат', 'Суп', 'Рагу', 'Запеканка', 'Пирог', 'Паста', 'Каша',
+    'Омлет', 'Плов', 'Котлеты', 'Блины', 'Смузи',
+)
+STYLES = (
+    'домашний', 'быстрый', 'праздничный', 'летний', 'острый', 'постный',
+)
+
+
+class ZipfSampler:
+    """Draws items with probability proportional to 1 / rank ** exponent.
+
+    Items are shuffled first, so popularity does not follow id order.
+    """
+
+    def __init__(self, items, exponent, rng):
+        self.items = list(items)
+        rng.shuffle(self.items)
+        self.rng = rng
+        self.cum_weights = list(itertools.accumulate(
+            1 / rank ** exponent for rank in range(1, len(self.items) + 1)
+        ))
+
+    def sample(self, k=1):
+        return self.rng.choices(self.items, cum_weights=self.cum_weights, k=k)
+
+    def sample_unique(self, k, exclude=None):
+        k = min(k, len(self.items) - (exclude is not None))
+        if 2 * k > len(self.items):
+            candidates = [item for item in self.items if item != exclude]
+            return set(self.rng.sample(candidates, k))
+        chosen = set()
+        while len(chosen) < k:
+            chosen.update(
+                item for item in self.sample(k - len(chosen))
+                if item != exclude
+            )
+        return chosen
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def make_image(size=(64, 64), color=(200, 120, 60)):
+    output = io.BytesIO()
+    Image.new('RGB', size, color).save(output, 'PNG')
+    return output.getvalue()
+
+
+class DatasetBuilder:
+    """Fills the database with synthetic users, recipes and relations.
+
+    Rows are written with bulk_create, which skips signals, so the
+    denormalized columns (tags_mask, ingredient_names, counters, shopping
+    lists, search index) are filled in directly and the caches are
+    invalidated at the end.
+    """
+
+    def __init__(self, rng, options, log):
+        self.rng = rng
+        self.options = options
+        self.log = log
+        self.batch_size = options['batch_size']
+
+    def build(self):
+        started = time.perf_counter()
+        with transaction.atomic():
+            ingredients = self.step('ingredients', self.create_ingredients)
+            tags = self.step('tags', self.create_tags)
+            users = self.step('users', self.create_users)
+            recipes = self.step(
+                'recipes', self.create_recipes, users, tags, ingredients
+            )
+            self.step('follows', self.create_relations, Follow, users,
+                      users, 'following', self.options['follows'])
+            self.step('favorites', self.create_relations, Favorite, users,
+                      recipes, 'recipe', self.options['favorites'])
+            self.step('carts', self.create_relations, ShoppingCart, users,
+                      recipes, 'recipe', self.options['carts'])
+            self.step('counters', self.rebuild_counters)
+            self.step('shopping lists', shopping_list.rebuild_items)
+        self.step('search', self.index, recipes)
+        bump_generation('recipes', 'authors', 'tags', 'ingredients')
+        self.log(f'Всего: {time.perf_counter() - started:.1f} с')
+
+    def step(self, name, func, *args):
+        started = time.perf_counter()
+        result = func(*args)
+        count = len(result) if isinstance(result, (list, dict)) else result
+        self.log(f'{name}: {count} за {time.perf_counter() - started:.1f} с')
+        return result
+
+    def create_ingredients(self):
+        path = self.options['ingredients']
+        if path:
+            load_ingredients(path)
+        ingredients = dict(Ingredient.objects.values_list('pk', 'name'))
+        if not ingredients:
+            raise ValueError('Нет ингредиентов для рецептов')
+        return ingredients
+
+    def create_tags(self):
+        tags = list(Tag.objects.order_by('pk'))
+        for index in range(len(tags), self.options['tags']):
+            tags.append(Tag.objects.create(
+                name=f'Тэг {index}', slug=f'bench-{index}'
+            ))
+        return tags
+
+    def create_users(self):
+        password = make_password(self.options['password'])
+        last_pk = User.objects.order_by('-pk').values_list(
+            'pk', flat=True
+        ).first() or 0
+        User.objects.bulk_create(
+            (User(
+                username=f'{USER_PREFIX}{index}',
+                email=f'{USER_PREFIX}{index}@example.com',
+                first_name='Пользователь',
+                last_name=str(index),
+                password=password,
+            ) for index in range(self.options['users'])),
+            batch_size=self.batch_size,
+        )
+        return list(User.objects.filter(pk__gt=last_pk).values_list(
+            'pk', flat=True
+        ))
+
+    def create_recipes(self, users, tags, ingredients):
+        if not default_storage.exists(IMAGE_NAME):
+            default_storage.save(IMAGE_NAME, ContentFile(make_image()))
+        rng = self.rng
+        authors = ZipfSampler(users, self.options['zipf'], rng)
+        ingredient_sampler = ZipfSampler(
+            ingredients, self.options['zipf'], rng
+        )
+        low, high = self.options['ingredients_per_recipe']
+        planned = []
+        recipes = []
+        for _ in range(self.options['recipes']):
+            picked = sorted(ingredient_sampler.sample_unique(
+                rng.randint(low, high)
+            ))
+            recipe_tags = rng.sample(tags, rng.randint(1, min(3, len(tags))))
+            names = [ingredients[pk] for pk in picked]
+            planned.append((picked, recipe_tags))
+            recipes.append(Recipe(
+                author_id=authors.sample()[0],
+                name='{} {} с ингредиентом «{}»'.format(
+                    rng.choice(DISHES), rng.choice(STYLES), names[0]
+                ),
+                text=' '.join(names) + '. Смешать и приготовить.',
+                image=IMAGE_NAME,
+                cooking_time=rng.randint(5, 180),
+                ingredient_names=search.join_names(names),
+                tags_mask=sum(tag.mask for tag in recipe_tags),
+            ))
+        last_pk = Recipe.objects.order_by('-pk').values_list(
+            'pk', flat=True
+        ).first() or 0
+        Recipe.objects.bulk_create(recipes, batch_size=self.batch_size)
+        pks = list(Recipe.objects.filter(pk__gt=last_pk).order_by(
+            'pk'
+        ).values_list('pk', flat=True))
+        self.bulk_create(IngredientAmount, (
+            IngredientAmount(
+                recipe_id=pk, ingredient_id=ingredient_id,
+                amount=rng.randint(1, 500),
+            )
+            for pk, (picked, _) in zip(pks, planned)
+            for ingredient_id in picked
+        ))
+        through = Recipe.tags.through
+        self.bulk_create(through, (
+            through(recipe_id=pk, tag_id=tag.pk)
+            for pk, (_, recipe_tags) in zip(pks, planned)
+            for tag in recipe_tags
+        ))
+        self.spread_dates(pks)
+        return pks
+
+    def spread_dates(self, pks):
+        now = timezone.now()
+        days = self.options['days']
+        for chunk in chunked(pks, self.batch_size):
+            Recipe.objects.bulk_update([
+                Recipe(pk=pk, pub_date=now - timedelta(
+                    seconds=self.rng.uniform(0, days * 24 * 60 * 60)
+                ))
+                for pk in chunk
+            ], ['pub_date'])
+
+    def create_relations(self, model, users, targets, field_name, mean):
+        """Every user gets ~`mean` rows pointing at Zipf-popular targets.
+        """
+        sampler = ZipfSampler(targets, self.options['zipf'], self.rng)
+        exclude = model is Follow
+
+        def rows():
+            for user_id in users:
+                count = min(
+                    round(self.rng.expovariate(1 / mean)) if mean else 0,
+                    len(targets) - exclude,
+                )
+                for target in sampler.sample_unique(
+                    count, user_id if exclude else None
+                ):
+                    yield model(user_id=user_id, **{
+                        f'{field_name}_id': target
+                    })
+        return self.bulk_create(model, rows())
+
+    def bulk_create(self, model, rows):
+        total = 0
+        for chunk in chunked(rows, self.batch_size):
+            model.objects.bulk_create(chunk, ignore_conflicts=True)
+            total += len(chunk)
+        return total
+
+    def rebuild_counters(self):
+        return sum(
+            rebuild_counter(model, field, related_model, field_name)
+            for model, field, related_model, field_name in COUNTERS
+        )
+
+    def index(self, pks):
+        for chunk in chunked(pks, self.batch_size):
+            search.index_recipes(Recipe.objects.filter(pk__in=chunk).only(
+                'pk', 'name', 'ingredient_names', 'text'
+            ))
+        return len(pks)
+
+
+class Result:
+    __slots__ = ('times', 'queries', 'sizes', 'errors', 'statuses')
+
+    def __init__(self):
+        self.times = []
+        self.queries = []
+        self.sizes = []
+        self.errors = 0
+        self.statuses = {}
+
+    def add(self, seconds, status, size, queries=None):
+        self.times.append(seconds)
+        self.sizes.append(size)
+        if queries is not None:
+            self.queries.append(queries)
+        self.statuses[str(status)] = self.statuses.get(str(status), 0) + 1
+        if status >= 400:
+            self.errors += 1
+
+    def summary(self, elapsed):
+        times = self.times
+        return {
+            'requests': len(times),
+            'errors': self.errors,
+            'statuses': self.statuses,
+            'throughput': len(times) / elapsed if elapsed else None,
+            'mean_ms': 1000 * sum(times) / len(times) if times else None,
+            'p50_ms': ms(percentile(times, 0.5)),
+            'p95_ms': ms(percentile(times, 0.95)),
+            'p99_ms': ms(percentile(times, 0.99)),
+            'queries_mean': (
+                sum(self.queries) / len(self.queries)
+                if self.queries else None
+            ),
+            'queries_max': max(self.queries, default=None),
+            'bytes_mean': sum(self.sizes) / len(self.sizes) if times else None,
+        }
+
+
+def ms(seconds):
+    return None if seconds is None else seconds * 1000
+
+
+class TestClientTransport:
+    """Runs requests in-process and counts their SQL queries."""
+
+    def __init__(self):
+        self.client = Client(HTTP_HOST='localhost')
+
+    def request(self, method, path, token=None, body=None):
+        client = self.client
+        headers = {}
+        if token:
+            headers['HTTP_AUTHORIZATION'] = f'Token {token}'
+        timer = QueryTimer()
+        started = time.perf_counter()
+        with connection.execute_wrapper(timer):
+            response = getattr(client, method.lower())(
+                path,
+                data=json.dumps(body) if body is not None else None,
+                content_type='application/json',
+                **headers,
+            )
+            if response.streaming:
+                content = b''.join(response.streaming_content)
+                response.close()
+            else:
+                content = response.content
+        elapsed = time.perf_counter() - started
+        return elapsed, response.status_code, content, timer.queries
+
+
+class HttpTransport:
+    """Runs requests against a running server; queries are unknown."""
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+
+    def request(self, method, path, token=None, body=None):
+        headers = {'Content-Type': 'application/json'}
+        if token:
+            headers['Authorization'] = f'Token {token}'
+        request = urllib.request.Request(
+            self.url + path,
+            data=json.dumps(body).encode() if body is not None else None,
+            headers=headers,
+            method=method,
+        )
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request) as response:
+                content = response.read()
+                status = response.status
+        except urllib.error.HTTPError as error:
+            content = error.read()
+            status = error.code
+        return time.perf_counter() - started, status, content, None
+
+
+class Benchmark:
+    """Drives the API endpoints with benchmark users and records timings.
+    """
+    scenarios = (
+        'recipes-list',
+        'recipes-list-authenticated',
+        'recipes-list-filtered',
+        'recipes-search',
+        'recipes-detail',
+        'users-subscriptions',
+        'recipes-download-txt',
+        'recipes-download-pdf',
+        'recipes-create',
+        'recipes-update',
+    )
+
+    def __init__(self, transport, rng, options):
+        self.transport = transport
+        self.rng = rng
+        self.options = options
+        users = list(User.objects.filter(
+            username__startswith=USER_PREFIX
+        ).order_by('pk').values_list('pk', flat=True)[:options['clients']])
+        if not users:
+            raise ValueError('Нет тестовых пользователей, '
+                             'сначала запустите seed_benchmark')
+        self.tokens = [
+            Token.objects.get_or_create(user_id=pk)[0].key for pk in users
+        ]
+        self.recipes = ZipfSampler(
+            Recipe.objects.values_list('pk', flat=True),
+            options['zipf'], rng,
+        )
+        self.tags = list(Tag.objects.values_list('slug', flat=True))
+        self.words = [
+            name.split()[0] for name in Ingredient.objects.order_by(
+                '?'
+            ).values_list('name', flat=True)[:200]
+        ]
+        self.image = 'data:image/png;base64,' + base64.b64encode(
+            make_image()
+        ).decode()
+        self.created = []
+
+    def run(self, scenarios, requests, warmup):
+        results = {}
+        for name in scenarios:
+            handler = getattr(self, 'scenario_' + name.replace('-', '_'))
+            for _ in range(warmup):
+                handler()
+            result = Result()
+            started = time.perf_counter()
+            with ThreadPoolExecutor(self.options['concurrency']) as pool:
+                for measured in pool.map(
+                    lambda _: handler(), range(requests)
+                ):
+                    result.add(*measured)
+            results[name] = result.summary(time.perf_counter() - started)
+        return results
+
+    def cleanup(self):
+        for recipe in Recipe.objects.filter(
+            pk__in=[pk for _, pk in self.created]
+        ):
+            recipe.delete()
+
+    def call(self, method, path, token=None, body=None):
+        seconds, status, content, queries = self.transport.request(
+            method, path, token, body
+        )
+        return (seconds, status, len(content), queries), content
+
+    def token(self):
+        return self.rng.choice(self.tokens)
+
+    def list_page_path(self):
+        offset = self.rng.randint(0, 4) * PAGE_SIZE
+        return f'/api/recipes/?limit={PAGE_SIZE}&offset={offset}'
+
+    def scenario_recipes_list(self):
+        return self.call('GET', self.list_page_path())[0]
+
+    def scenario_recipes_list_authenticated(self):
+        # Authenticated reads skip the anonymous response cache.
+        return self.call('GET', self.list_page_path(), self.token())[0]
+
+    def scenario_recipes_list_filtered(self):
+        tags = '&'.join(
+            f'tags={slug}' for slug in self.rng.sample(
+                self.tags, min(2, len(self.tags))
+            )
+        )
+        return self.call(
+            'GET', f'/api/recipes/?limit=6&is_favorited=0&{tags}',
+            self.token(),
+        )[0]
+
+    def scenario_recipes_search(self):
+        word = urllib.parse.quote(self.rng.choice(self.words))
+        return self.call('GET', f'/api/recipes/?limit=6&search={word}')[0]
+
+    def scenario_recipes_detail(self):
+        pk = self.recipes.sample()[0]
+        return self.call('GET', f'/api/recipes/{pk}/', self.token())[0]
+
+    def scenario_users_subscriptions(self):
+        return self.call(
+            'GET', '/api/users/subscriptions/?limit=6&recipes_limit=3',
+            self.token(),
+        )[0]
+
+    def scenario_recipes_download_txt(self):
+        return self.call(
+            'GET', '/api/recipes/download_shopping_cart/?format=txt',
+            self.token(),
+        )[0]
+
+    def scenario_recipes_download_pdf(self):
+        return self.call(
+            'GET', '/api/recipes/download_shopping_cart/?format=pdf',
+            self.token(),
+        )[0]
+
+    def recipe_body(self):
+        ingredients = Ingredient.objects.order_by('?').values_list(
+            'pk', flat=True
+        )[:self.rng.randint(3, 8)]
+        return {
+            'name': 'Тестовый рецепт',
+            'text': 'Смешать и приготовить.',
+            'cooking_time': self.rng.randint(5, 180),
+            'image': self.image,
+            'tags': [
+                tag.pk for tag in self.rng.sample(
+                    list(Tag.objects.all()), min(2, len(self.tags))
+                )
+            ],
+            'ingredients': [
+                {'id': pk, 'amount': self.rng.randint(1, 500)}
+                for pk in ingredients
+            ],
+        }
+
+    def scenario_recipes_create(self):
+        token = self.token()
+        measured, content = self.call(
+            'POST', '/api/recipes/', token, self.recipe_body()
+        )
+        if measured[1] == 201:
+            self.created.append((token, json.loads(content)['id']))
+        return measured
+
+    def scenario_recipes_update(self):
+        if not self.created:
+            self.scenario_recipes_create()
+        token, pk = self.rng.choice(self.created)
+        body = self.recipe_body()
+        del body['image']
+        return self.call('PATCH', f'/api/recipes/{pk}/', token, body)[0]
@@ -0,0 +1,67 @@
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from recipe.models import Favorite, Follow, Recipe, ShoppingCart, User
+
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'shopping_cart_count', ShoppingCart, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Follow, 'following'),
+    (User, 'following_count', Follow, 'user'),
+)
+
+
+def change_counter(model, pks, field, delta):
+    model.objects.filter(pk__in=pks).update(
+        **{field: Greatest(F(field) + delta, 0)}
+    )
+
+
+def count_row(instance, delta):
+    for model, field, related_model, field_name in COUNTERS:
+        if isinstance(instance, related_model):
+            change_counter(
+                model, [getattr(instance, f'{field_name}_id')], field, delta
+            )
+
+
+def actual_count(related_model, field_name):
+    return Coalesce(Subquery(
+        related_model.objects.filter(
+            **{field_name: OuterRef('pk')}
+        ).order_by().values(field_name).annotate(
+            total=Count('pk')
+        ).values('total')
+    ), 0)
+
+
+def stale_rows(model, field, related_model, field_name):
+    return model.objects.annotate(
+        actual=actual_count(related_model, field_name)
+    ).exclude(**{field: F('actual')})
+
+
+def rebuild_counter(model, field, related_model, field_name):
+    stale = stale_rows(model, field, related_model, field_name)
+    return model.objects.filter(pk__in=stale.values('pk')).update(
+        **{field: actual_count(related_model, field_name)}
+    )
+
+
+def recount(model, field, related_model, field_name, pks):
+    """Sets the counter of `pks` from the related rows in one UPDATE."""
+    return model.objects.filter(pk__in=pks).update(
+        **{field: actual_count(related_model, field_name)}
+    )
+
+
+def recount_rows(related_model, values):
+    """Recounts every counter fed by `related_model`.
+
+    `values` maps the counted foreign key name to the affected ids.
+    """
+    for model, field, counted_model, field_name in COUNTERS:
+        if counted_model is related_model and values.get(field_name):
+            recount(model, field, related_model, field_name,
+                    values[field_name])
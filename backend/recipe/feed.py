@@ -0,0 +1,179 @@
+from django.conf import settings
+from django.db import connection
+from django.db.models import Exists, F, OuterRef, Q, Window
+from django.db.models.functions import RowNumber
+
+from jobs.queue import job
+from recipe.models import FeedEntry, Follow, Recipe, User
+
+
+def is_fanned_out(followers_count):
+    """Authors with more followers are merged into feeds on read."""
+    return followers_count <= settings.FEED_FANOUT_LIMIT
+
+
+def overflowing(user_ids):
+    """Users whose feed has grown FEED_TRIM_SLACK entries past FEED_LENGTH.
+
+    Each user costs one index probe, and the feeds are trimmed once per
+    FEED_TRIM_SLACK insertions instead of on every fan-out batch.
+    """
+    limit = settings.FEED_LENGTH + settings.FEED_TRIM_SLACK
+    extra = FeedEntry.objects.filter(user_id=OuterRef('pk'))[limit:]
+    return list(User.objects.filter(pk__in=user_ids).filter(
+        Exists(extra)
+    ).values_list('pk', flat=True))
+
+
+def trim(user_ids):
+    """Keeps only the FEED_LENGTH newest entries of each user."""
+    user_ids = overflowing(user_ids)
+    if not user_ids:
+        return
+    ranked = FeedEntry.objects.filter(user_id__in=user_ids).annotate(
+        position=Window(
+            expression=RowNumber(),
+            partition_by=[F('user_id')],
+            order_by=[F('pub_date').desc(), F('recipe_id').desc()],
+        )
+    ).order_by().values('id', 'position')
+    sql, params = ranked.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {FeedEntry._meta.db_table} WHERE id IN '
+            f'(SELECT id FROM ({sql}) ranked WHERE position > %s)',
+            (*params, settings.FEED_LENGTH),
+        )
+
+
+def add_entries(entries, user_ids):
+    FeedEntry.objects.bulk_create(entries, ignore_conflicts=True)
+    trim(user_ids)
+
+
+@job
+def fan_out(recipe_id):
+    """Copies a new recipe into the feeds of the author's followers."""
+    recipe = Recipe.objects.filter(pk=recipe_id).values(
+        'author_id', 'pub_date', 'author__followers_count'
+    ).first()
+    if recipe is None or not is_fanned_out(recipe['author__followers_count']):
+        return
+    followers = Follow.objects.filter(
+        following_id=recipe['author_id']
+    ).order_by('user_id').values_list('user_id', flat=True)
+    last = 0
+    while True:
+        user_ids = list(
+            followers.filter(user_id__gt=last)[:settings.FEED_BATCH_SIZE]
+        )
+        if not user_ids:
+            return
+        add_entries([
+            FeedEntry(
+                user_id=user_id,
+                recipe_id=recipe_id,
+                author_id=recipe['author_id'],
+                pub_date=recipe['pub_date'],
+            )
+            for user_id in user_ids
+        ], user_ids)
+        last = user_ids[-1]
+
+
+@job
+def backfill(user_id, author_id):
+    """Puts the latest recipes of a newly followed author into a feed."""
+    follows = Follow.objects.filter(user_id=user_id, following_id=author_id)
+    followers_count = User.objects.filter(pk=author_id).values_list(
+        'followers_count', flat=True
+    ).first()
+    if (
+        followers_count is None or not is_fanned_out(followers_count)
+        or not follows.exists()
+    ):
+        return
+    recipes = Recipe.objects.filter(author_id=author_id).order_by(
+        '-pub_date', '-id'
+    ).values_list('pk', 'pub_date')[:settings.FEED_LENGTH]
+    add_entries([
+        FeedEntry(
+            user_id=user_id,
+            recipe_id=pk,
+            author_id=author_id,
+            pub_date=pub_date,
+        )
+        for pk, pub_date in recipes
+    ], [user_id])
+
+
+@job
+def backfill_followers(author_id):
+    """Fills the feeds of all followers once the author is fanned out again.
+
+    Recipes published while the author had more than FEED_FANOUT_LIMIT
+    followers never reached the timelines.
+    """
+    followers_count = User.objects.filter(pk=author_id).values_list(
+        'followers_count', flat=True
+    ).first()
+    if followers_count is None or not is_fanned_out(followers_count):
+        return
+    recipes = list(Recipe.objects.filter(author_id=author_id).order_by(
+        '-pub_date', '-id'
+    ).values_list('pk', 'pub_date')[:settings.FEED_LENGTH])
+    if not recipes:
+        return
+    followers = Follow.objects.filter(following_id=author_id).order_by(
+        'user_id'
+    ).values_list('user_id', flat=True)
+    batch_size = max(1, settings.FEED_BATCH_SIZE // len(recipes))
+    last = 0
+    while True:
+        user_ids = list(followers.filter(user_id__gt=last)[:batch_size])
+        if not user_ids:
+            return
+        add_entries([
+            FeedEntry(
+                user_id=user_id,
+                recipe_id=pk,
+                author_id=author_id,
+                pub_date=pub_date,
+            )
+            for user_id in user_ids
+            for pk, pub_date in recipes
+        ], user_ids)
+        last = user_ids[-1]
+
+
+def remove_author(user_id, author_id):
+    FeedEntry.objects.filter(user_id=user_id, author_id=author_id).delete()
+
+
+def follower_removed(author_id):
+    """Backfills the author's followers when the count falls to the limit."""
+    followers_count = User.objects.filter(pk=author_id).values_list(
+        'followers_count', flat=True
+    ).first()
+    if followers_count == settings.FEED_FANOUT_LIMIT:
+        backfill_followers.delay(author_id)
+
+
+def feed_recipes(user):
+    """Recipes of the authors `user` follows.
+
+    Most come from the user's precomputed timeline (bounded by
+    FEED_LENGTH, so the id list is small); authors over
+    FEED_FANOUT_LIMIT followers are never fanned out and are read from
+    Recipe directly.
+    """
+    read_authors = list(Follow.objects.filter(
+        user=user,
+        following__followers_count__gt=settings.FEED_FANOUT_LIMIT,
+    ).values_list('following_id', flat=True))
+    timeline = list(FeedEntry.objects.filter(user=user).exclude(
+        author_id__in=read_authors
+    ).values_list('recipe_id', flat=True))
+    return Recipe.objects.filter(
+        Q(pk__in=timeline) | Q(author_id__in=read_authors)
+    )
@@ -0,0 +1,221 @@
+import io
+import os
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models import Q
+from PIL import Image, ImageOps
+
+from api.cache import bump_generation
+from jobs.queue import job
+
+# Variant sizes per image field: name -> (width, height, crop). Cropped
+# variants are filled to the exact box, the others only fit inside it.
+VARIANTS = {
+    'image': {
+        'detail': (1280, 1280, False),
+        'card': (600, 400, True),
+    },
+    'avatar': {
+        'avatar': (192, 192, True),
+    },
+}
+FORMATS = {
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', {
+        'quality': 82, 'optimize': True, 'progressive': True
+    }),
+}
+
+
+def variants_field(field_name):
+    return f'{field_name}_variants'
+
+
+def is_ready(field_file, variants):
+    return bool(
+        field_file and variants
+        and variants.get('source') == field_file.name
+    )
+
+
+def variant_paths(variants):
+    return [
+        variant[fmt]
+        for name, variant in (variants or {}).items()
+        if name != 'source'
+        for fmt in FORMATS
+    ]
+
+
+def describe(field_file, variants, field_name):
+    """Variant URLs and srcset strings, the original until they are ready.
+    """
+    if not field_file:
+        return None
+    ready = is_ready(field_file, variants)
+    original = field_file.url
+    images = {}
+    srcset = {fmt: [] for fmt in FORMATS}
+    for name in VARIANTS[field_name]:
+        variant = variants.get(name) if ready else None
+        if variant is None:
+            images[name] = {fmt: original for fmt in FORMATS}
+            continue
+        images[name] = {}
+        for fmt in FORMATS:
+            url = default_storage.url(variant[fmt])
+            images[name][fmt] = url
+            srcset[fmt].append(f'{url} {variant["width"]}w')
+    images['srcset'] = {
+        fmt: ', '.join(entries) or original
+        for fmt, entries in srcset.items()
+    }
+    return images
+
+
+def open_image(field_file, sizes):
+    field_file.open('rb')
+    try:
+        image = Image.open(field_file)
+        largest = max(max(width, height) for width, height, _ in sizes)
+        image.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    finally:
+        field_file.close()
+    if image.mode not in ('RGB', 'RGBA'):
+        alpha = image.mode in ('LA', 'PA') or 'transparency' in image.info
+        image = image.convert('RGBA' if alpha else 'RGB')
+    return image
+
+
+def resize(image, width, height, crop):
+    if not crop:
+        image = image.copy()
+        image.thumbnail((width, height), Image.LANCZOS)
+        return image
+    ratio = min(1, image.width / width, image.height / height)
+    size = (max(1, round(width * ratio)), max(1, round(height * ratio)))
+    return ImageOps.fit(image, size, Image.LANCZOS)
+
+
+def encode(image, fmt):
+    pillow_format, _, options = FORMATS[fmt]
+    if pillow_format == 'JPEG' and image.mode == 'RGBA':
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    output = io.BytesIO()
+    image.save(output, pillow_format, **options)
+    return output.getvalue()
+
+
+def render_variants(field_file, field_name, pk):
+    """Writes every variant of `field_file` and returns their description.
+    """
+    specs = VARIANTS[field_name]
+    image = open_image(field_file, specs.values())
+    directory, filename = os.path.split(field_file.name)
+    stem = os.path.splitext(filename)[0]
+    variants = {'source': field_file.name}
+    for name, (width, height, crop) in specs.items():
+        resized = resize(image, width, height, crop)
+        variant = {'width': resized.width, 'height': resized.height}
+        for fmt, (_, extension, _) in FORMATS.items():
+            path = os.path.join(
+                directory, 'variants', f'{stem}_{pk}_{name}.{extension}'
+            )
+            if default_storage.exists(path):
+                default_storage.delete(path)
+            variant[fmt] = default_storage.save(
+                path, ContentFile(encode(resized, fmt))
+            )
+        variants[name] = variant
+        image = resized if not crop else image
+    return variants
+
+
+@job
+def delete_files(paths):
+    for path in paths:
+        default_storage.delete(path)
+
+
+def delete_unused(model, field_name, name):
+    if not settings.IMAGE_DELETE_ORIGINALS:
+        return
+    if name and not model.objects.filter(**{field_name: name}).exists():
+        default_storage.delete(name)
+
+
+@job
+def delete_image(model_label, field_name, name, paths):
+    """Removes the variants and, with IMAGE_DELETE_ORIGINALS, the original
+    if no row uses it any more.
+    """
+    delete_files(paths)
+    delete_unused(apps.get_model(model_label), field_name, name)
+
+
+@job(max_attempts=3)
+def update_variants(model_label, pk, field_name, scopes, force=False):
+    """Brings the stored variants of one row in line with its image.
+
+    The result is only written if the image did not change meanwhile,
+    otherwise the save that changed it has queued its own update. With
+    IMAGE_DELETE_ORIGINALS the replaced original is removed once nothing
+    refers to it.
+    """
+    model = apps.get_model(model_label)
+    variants_name = variants_field(field_name)
+    instance = model.objects.filter(pk=pk).only(
+        'pk', field_name, variants_name
+    ).first()
+    if instance is None:
+        return
+    field_file = getattr(instance, field_name)
+    old = getattr(instance, variants_name) or {}
+    if not (field_file or old):
+        return
+    if is_ready(field_file, old) and not force:
+        return
+    if field_file:
+        new = render_variants(field_file, field_name, pk)
+        same_image = Q(**{field_name: field_file.name})
+    else:
+        new = {}
+        same_image = Q(**{f'{field_name}__isnull': True}) | Q(
+            **{field_name: ''}
+        )
+    updated = model.objects.filter(same_image, pk=pk).update(
+        **{variants_name: new}
+    )
+    if not updated:
+        delete_files(variant_paths(new))
+        return
+    delete_files(set(variant_paths(old)) - set(variant_paths(new)))
+    if old.get('source') != new.get('source'):
+        delete_unused(model, field_name, old.get('source'))
+    bump_generation(*scopes)
+
+
+def schedule_update(instance, field_name, scopes):
+    field_file = getattr(instance, field_name)
+    variants = getattr(instance, variants_field(field_name))
+    if is_ready(field_file, variants) or not (field_file or variants):
+        return
+    update_variants.delay(
+        instance._meta.label, instance.pk, field_name, list(scopes)
+    )
+
+
+def schedule_delete(instance, field_name):
+    field_file = getattr(instance, field_name)
+    paths = variant_paths(getattr(instance, variants_field(field_name)))
+    if field_file or paths:
+        delete_image.delay(
+            instance._meta.label, field_name, field_file.name or '', paths
+        )
@@ -0,0 +1,231 @@
+import csv
+import io
+import json
+import os
+
+from django.db import connections, transaction
+
+from api.cache import bump_generation
+from recipe import ingredient_index, search
+from recipe.models import Ingredient
+
+CHUNK_SIZE = 5000
+READ_SIZE = 64 * 1024
+STAGING_TABLE = 'ingredient_import'
+FORMATS = ('csv', 'json')
+
+
+def detect_format(path):
+    extension = os.path.splitext(path)[1].lstrip('.').lower()
+    if extension not in FORMATS:
+        raise ValueError(f'Неизвестный формат файла: {path}')
+    return extension
+
+
+def read_csv(ingredients_file):
+    """Rows of a CSV file as dicts.
+
+    Spaces after commas are ignored (the catalogue has
+    `name, measurement_unit` and `1, "молоко 3,2%",мл`), header names are
+    lowercased; a file without a `name` column is read as name,
+    measurement_unit pairs.
+    """
+    rows = csv.reader(ingredients_file, skipinitialspace=True)
+    header = [column.strip().lower() for column in next(rows, [])]
+    if 'name' not in header:
+        if len(header) >= 2:
+            yield {'name': header[0], 'measurement_unit': header[1]}
+        header = ['name', 'measurement_unit']
+    for row in rows:
+        yield dict(zip(header, row))
+
+
+def read_json(ingredients_file):
+    """Objects of a top-level JSON array, decoded one at a time."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    eof = False
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+        if position < len(buffer) and not started:
+            if buffer[position] != '[':
+                raise ValueError('Ожидался список объектов')
+            started = True
+            position += 1
+            continue
+        if position < len(buffer) and buffer[position] == ']':
+            return
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                raise ValueError('Файл JSON поврежден или обрезан')
+            chunk = ingredients_file.read(READ_SIZE)
+            eof = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        if not started or not isinstance(item, dict):
+            raise ValueError('Ожидался список объектов')
+        position = end
+        yield {str(key).strip().lower(): value for key, value in item.items()}
+
+
+READERS = {'csv': read_csv, 'json': read_json}
+
+
+def clean_rows(rows, stats):
+    """(id, name, measurement_unit) of valid rows; repeats are dropped
+    here and end up as skipped.
+    """
+    name_length = Ingredient._meta.get_field('name').max_length
+    unit_length = Ingredient._meta.get_field(
+        'measurement_unit'
+    ).max_length
+    seen = set()
+    for row in rows:
+        stats['total'] += 1
+        name = str(row.get('name') or '').strip()
+        unit = str(row.get('measurement_unit') or '').strip()
+        key = (name, unit)
+        if (
+            not name or not unit or len(name) > name_length
+            or len(unit) > unit_length
+        ):
+            stats['invalid'] += 1
+            continue
+        if key in seen:
+            continue
+        seen.add(key)
+        pk = str(row.get('id') or '').strip()
+        yield int(pk) if pk.isdigit() else None, name, unit
+
+
+def chunks(rows, size=CHUNK_SIZE):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class Loader:
+    """Upserts ingredients on the (name, measurement_unit) constraint.
+
+    Rows already present are left alone, so loading the same file again
+    changes nothing. With `by_id` a row whose id exists under another
+    name or unit renames that ingredient instead of adding a new one.
+    """
+
+    def __init__(self, using='default', by_id=False):
+        self.connection = connections[using]
+        self.using = using
+        self.by_id = by_id
+        self.table = Ingredient._meta.db_table
+        self.updated_ids = []
+
+    def load(self, rows, stats):
+        with transaction.atomic(using=self.using):
+            with self.connection.cursor() as cursor:
+                if self.connection.vendor == 'postgresql':
+                    self.copy_postgresql(cursor, rows)
+                    self.merge_postgresql(cursor, stats)
+                else:
+                    for chunk in chunks(rows):
+                        self.load_chunk(cursor, chunk, stats)
+        stats['updated'] = len(self.updated_ids)
+        stats['skipped'] = stats['total'] - sum(
+            stats[name] for name in ('inserted', 'updated', 'invalid')
+        )
+        if stats['inserted'] or stats['updated']:
+            transaction.on_commit(self.changed, using=self.using)
+        return stats
+
+    def copy_postgresql(self, cursor, rows):
+        cursor.execute(
+            f'CREATE TEMPORARY TABLE {STAGING_TABLE} ('
+            'id bigint, name varchar(128), measurement_unit varchar(64)'
+            ') ON COMMIT DROP'
+        )
+        for chunk in chunks(rows):
+            data = io.StringIO()
+            csv.writer(data).writerows(
+                ('' if pk is None else pk, name, unit)
+                for pk, name, unit in chunk
+            )
+            data.seek(0)
+            cursor.copy_expert(
+                f'COPY {STAGING_TABLE} (id, name, measurement_unit) '
+                'FROM STDIN WITH (FORMAT csv)',
+                data,
+            )
+
+    def merge_postgresql(self, cursor, stats):
+        if self.by_id:
+            cursor.execute(
+                f'UPDATE {self.table} AS ingredient '
+                'SET name = staged.name, '
+                'measurement_unit = staged.measurement_unit '
+                f'FROM {STAGING_TABLE} AS staged '
+                'WHERE ingredient.id = staged.id '
+                'AND (ingredient.name, ingredient.measurement_unit) '
+                '<> (staged.name, staged.measurement_unit) '
+                f'AND NOT EXISTS (SELECT 1 FROM {self.table} AS other '
+                'WHERE other.name = staged.name '
+                'AND other.measurement_unit = staged.measurement_unit) '
+                'RETURNING ingredient.id'
+            )
+            self.updated_ids = [pk for pk, in cursor.fetchall()]
+        cursor.execute(
+            f'INSERT INTO {self.table} (name, measurement_unit) '
+            f'SELECT name, measurement_unit FROM {STAGING_TABLE} '
+            'ON CONFLICT (name, measurement_unit) DO NOTHING'
+        )
+        stats['inserted'] = cursor.rowcount
+
+    def load_chunk(self, cursor, chunk, stats):
+        if self.by_id:
+            for pk, name, unit in chunk:
+                if pk is None:
+                    continue
+                cursor.execute(
+                    f'UPDATE {self.table} SET name = %s, '
+                    'measurement_unit = %s '
+                    'WHERE id = %s AND NOT (name = %s AND '
+                    'measurement_unit = %s) AND NOT EXISTS ('
+                    f'SELECT 1 FROM {self.table} WHERE name = %s '
+                    'AND measurement_unit = %s)',
+                    (name, unit, pk, name, unit, name, unit),
+                )
+                if cursor.rowcount:
+                    self.updated_ids.append(pk)
+        cursor.executemany(
+            f'INSERT INTO {self.table} (name, measurement_unit) '
+            'VALUES (%s, %s) ON CONFLICT (name, measurement_unit) '
+            'DO NOTHING',
+            [(name, unit) for _, name, unit in chunk],
+        )
+        stats['inserted'] += max(cursor.rowcount, 0)
+
+    def changed(self):
+        bump_generation('ingredients')
+        ingredient_index.invalidate()
+        for pk in self.updated_ids:
+            search.refresh_ingredient.delay(pk)
+
+
+def load_ingredients(path, file_format=None, using='default', by_id=False):
+    """Loads a CSV or JSON catalogue file and returns the row counts."""
+    file_format = file_format or detect_format(path)
+    stats = dict.fromkeys(
+        ('total', 'inserted', 'updated', 'skipped', 'invalid'), 0
+    )
+    with open(path, encoding='utf-8-sig', newline='') as ingredients_file:
+        rows = clean_rows(READERS[file_format](ingredients_file), stats)
+        return Loader(using, by_id).load(rows, stats)
@@ -0,0 +1,163 @@
+import bisect
+import heapq
+import threading
+import time
+from collections import defaultdict
+
+from api.cache import get_generation
+from recipe.models import Ingredient
+
+NGRAM_SIZE = 2
+MIN_FUZZY_LENGTH = 5
+FUZZY_CANDIDATES = 20
+CHECK_INTERVAL = 1.0
+
+
+def normalize(value):
+    return ' '.join(value.casefold().replace('ё', 'е').split())
+
+
+def ngrams(value):
+    padded = f' {value} '
+    return {
+        padded[i:i + NGRAM_SIZE]
+        for i in range(len(padded) - NGRAM_SIZE + 1)
+    }
+
+
+def edit_distance(first, second, limit):
+    """Levenshtein distance, or limit + 1 once it is known to exceed it."""
+    previous = list(range(len(second) + 1))
+    for i, char in enumerate(first, 1):
+        current = [i]
+        for j, other in enumerate(second, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char != other),
+            ))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class IngredientIndex:
+    """Prefix and n-gram index over the ingredient catalogue.
+
+    Matches are ranked: exact name, name prefix, word prefix, substring,
+    then names whose words start within a small edit distance of the
+    query, which catches misspellings.
+    """
+
+    def __init__(self, rows):
+        self.items = {}
+        self.keys = {}
+        self.prefixes = []
+        self.word_starts = defaultdict(list)
+        self.grams = defaultdict(list)
+        for pk, name, measurement_unit in rows:
+            key = normalize(name)
+            self.items[pk] = {
+                'id': pk, 'name': name, 'measurement_unit': measurement_unit
+            }
+            self.keys[pk] = key
+            start = 0
+            for word in key.split(' '):
+                self.prefixes.append((key[start:], start == 0, pk))
+                self.word_starts[pk].append(key[start:])
+                start += len(word) + 1
+            for gram in ngrams(key):
+                self.grams[gram].append(pk)
+        self.prefixes.sort()
+        self.ordered = [self.items[pk] for pk in sorted(self.items)]
+
+    def __len__(self):
+        return len(self.items)
+
+    def search(self, query, limit=None):
+        query = normalize(query)
+        if not query:
+            return self.ordered[:limit]
+        ranks = {}
+        start = bisect.bisect_left(self.prefixes, (query,))
+        for suffix, is_name, pk in self.prefixes[start:]:
+            if not suffix.startswith(query):
+                break
+            if self.keys[pk] == query:
+                rank = (0, 0)
+            else:
+                rank = (1 if is_name else 2, 0)
+            ranks[pk] = min(rank, ranks.get(pk, rank))
+        if limit is None or len(ranks) < limit:
+            self.add_approximate_matches(query, ranks)
+        found = sorted(
+            ranks,
+            key=lambda pk: (ranks[pk], len(self.keys[pk]), self.keys[pk])
+        )
+        return [self.items[pk] for pk in found[:limit]]
+
+    def add_approximate_matches(self, query, ranks):
+        query_grams = ngrams(query)
+        hits = defaultdict(int)
+        for gram in query_grams:
+            for pk in self.grams.get(gram, ()):
+                hits[pk] += 1
+        candidates = []
+        for pk, count in hits.items():
+            if pk in ranks:
+                continue
+            if query in self.keys[pk]:
+                ranks[pk] = (3, 0)
+            else:
+                candidates.append((count, pk))
+        if len(query) < MIN_FUZZY_LENGTH:
+            return
+        max_distance = len(query) // 3
+        # A word start within max_distance edits of the query still shares
+        # all but (1 + NGRAM_SIZE * max_distance) of its padded n-grams.
+        min_hits = len(query_grams) - 1 - NGRAM_SIZE * max_distance
+        distances = {}
+        for count, pk in heapq.nlargest(FUZZY_CANDIDATES, candidates):
+            if count < min_hits:
+                break
+            for start in self.word_starts[pk]:
+                start = start[:len(query)]
+                if start not in distances:
+                    distances[start] = edit_distance(
+                        query, start, max_distance
+                    )
+            distance = min(
+                distances[start[:len(query)]]
+                for start in self.word_starts[pk]
+            )
+            if distance <= max_distance:
+                ranks[pk] = (4, distance)
+
+
+_index = None
+_generation = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def get_index():
+    global _index, _generation, _checked_at
+    if _index is not None and time.monotonic() - _checked_at < CHECK_INTERVAL:
+        return _index
+    generation = get_generation('ingredients')
+    with _lock:
+        if _index is None or generation != _generation:
+            _index = IngredientIndex(
+                Ingredient.objects.values_list(
+                    'id', 'name', 'measurement_unit'
+                ).iterator()
+            )
+            _generation = generation
+        _checked_at = time.monotonic()
+    return _index
+
+
+def invalidate():
+    global _checked_at
+    _checked_at = 0.0
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+
+from recipe.images import is_ready, update_variants, variants_field
+from recipe.models import Recipe, User
+
+SOURCES = (
+    (Recipe, 'image', lambda pk: ['recipes', f'recipe:{pk}']),
+    (User, 'avatar', lambda pk: ['authors']),
+)
+
+
+class Command(BaseCommand):
+    help = ('Ставит в очередь задачи на уменьшенные копии картинок '
+            'рецептов и аватаров')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Пересоздать и уже готовые варианты',
+        )
+
+    def handle(self, *args, **options):
+        for model, field_name, scopes in SOURCES:
+            rows = model.objects.exclude(
+                **{field_name: ''}
+            ).exclude(
+                **{f'{field_name}__isnull': True}
+            ).only('pk', field_name, variants_field(field_name))
+            pks = [
+                row.pk for row in rows.iterator()
+                if options['force'] or not is_ready(
+                    getattr(row, field_name),
+                    getattr(row, variants_field(field_name)),
+                )
+            ]
+            for pk in pks:
+                update_variants.delay(
+                    model._meta.label, pk, field_name, scopes(pk),
+                    force=options['force'],
+                )
+            self.stdout.write(
+                f'{model._meta.model_name}.{field_name}: '
+                f'в очереди {len(pks)}'
+            )
+        self.stdout.write(self.style.SUCCESS('Готово'))
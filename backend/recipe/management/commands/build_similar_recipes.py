@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from recipe.similar import build
+
+
+class Command(BaseCommand):
+    help = 'Заново рассчитывает похожие рецепты'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--count', type=int, default=None,
+            help='Сколько похожих рецептов хранить для каждого рецепта',
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=None,
+            help='Сколько рецептов обрабатывать за одну транзакцию',
+        )
+
+    def handle(self, *args, **options):
+        total = build(options['count'], options['chunk_size'])
+        self.stdout.write(f'Сохранено пар: {total}')
+        self.stdout.write(self.style.SUCCESS('Готово'))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipe.ingredient_import import FORMATS, load_ingredients
+
+
+class Command(BaseCommand):
+    help = 'Загружает ингредиенты из CSV или JSON, не создавая дублей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='Файлы с ингредиентами')
+        parser.add_argument(
+            '--format',
+            choices=FORMATS,
+            help='Формат файлов (по умолчанию по расширению)',
+        )
+        parser.add_argument(
+            '--by-id',
+            action='store_true',
+            help='Переименовывать ингредиенты с совпадающим id',
+        )
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        for path in options['paths']:
+            try:
+                stats = load_ingredients(
+                    path, options['format'], options['database'],
+                    options['by_id'],
+                )
+            except (OSError, ValueError, UnicodeDecodeError) as error:
+                raise CommandError(f'{path}: {error}')
+            self.stdout.write(
+                '{}: всего {total}, добавлено {inserted}, '
+                'обновлено {updated}, пропущено {skipped}, '
+                'с ошибками {invalid}'.format(path, **stats)
+            )
+        self.stdout.write(self.style.SUCCESS('Готово'))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipe.counters import COUNTERS, rebuild_counter, stale_rows
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счетчики избранного, корзин, рецептов и подписок'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только проверить счетчики, ничего не меняя',
+        )
+
+    def handle(self, *args, **options):
+        total = 0
+        for model, field, related_model, field_name in COUNTERS:
+            label = f'{model._meta.model_name}.{field}'
+            if options['check']:
+                stale = stale_rows(model, field, related_model, field_name)
+                count = stale.count()
+            else:
+                count = rebuild_counter(
+                    model, field, related_model, field_name
+                )
+            total += count
+            self.stdout.write(f'{label}: {count}')
+        if options['check'] and total:
+            raise CommandError(f'Расхождений в счетчиках: {total}')
+        self.stdout.write(self.style.SUCCESS('Готово'))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from recipe.feed import backfill
+from recipe.models import FeedEntry, Follow
+
+
+class Command(BaseCommand):
+    help = 'Заново заполняет ленты подписок'
+
+    def handle(self, *args, **options):
+        deleted = FeedEntry.objects.all().delete()[0]
+        follows = Follow.objects.order_by('id').values_list(
+            'user_id', 'following_id'
+        )
+        count = 0
+        for user_id, author_id in follows.iterator():
+            backfill(user_id, author_id)
+            count += 1
+        self.stdout.write(f'Удалено записей: {deleted}, подписок: {count}')
+        self.stdout.write(self.style.SUCCESS('Готово'))
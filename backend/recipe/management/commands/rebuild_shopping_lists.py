@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipe.shopping_list import rebuild_items, stale_items
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает списки покупок по корзинам'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только проверить списки покупок, ничего не меняя',
+        )
+
+    def handle(self, *args, **options):
+        if options['check']:
+            count = len(stale_items())
+            self.stdout.write(f'Расхождений: {count}')
+            if count:
+                raise CommandError(
+                    f'Расхождений в списках покупок: {count}'
+                )
+        else:
+            count = rebuild_items()
+            self.stdout.write(f'Строк в списках покупок: {count}')
+        self.stdout.write(self.style.SUCCESS('Готово'))
@@ -0,0 +1,121 @@
+import json
+import random
+import subprocess
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from recipe.benchmark import (
+    Benchmark,
+    HttpTransport,
+    TestClientTransport,
+)
+
+COLUMNS = ('requests', 'errors', 'throughput', 'p50_ms', 'p95_ms',
+           'p99_ms', 'queries_mean')
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def format_value(value):
+    if value is None:
+        return '-'
+    return f'{value:.1f}' if isinstance(value, float) else str(value)
+
+
+class Command(BaseCommand):
+    help = 'Замеряет время ответа основных эндпоинтов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scenario', action='append', dest='scenarios',
+            choices=Benchmark.scenarios,
+            help='Сценарий (можно несколько, по умолчанию все)',
+        )
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Запросов на сценарий')
+        parser.add_argument('--warmup', type=int, default=10)
+        parser.add_argument('--url', default='',
+                            help='Адрес запущенного сервера вместо '
+                                 'тестового клиента')
+        parser.add_argument('--concurrency', type=int, default=1,
+                            help='Одновременных запросов (только с --url)')
+        parser.add_argument('--clients', type=int, default=50,
+                            help='Сколько тестовых пользователей '
+                                 'задействовать')
+        parser.add_argument('--zipf', type=float, default=1.1)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', default='',
+                            help='Куда сохранить результаты (JSON)')
+        parser.add_argument('--compare', default='',
+                            help='Результаты прошлого запуска для сравнения')
+
+    def handle(self, *args, **options):
+        if options['url']:
+            transport = HttpTransport(options['url'])
+        else:
+            if options['concurrency'] != 1:
+                raise CommandError('--concurrency работает только с --url')
+            transport = TestClientTransport()
+        try:
+            benchmark = Benchmark(
+                transport, random.Random(options['seed']), options
+            )
+        except ValueError as error:
+            raise CommandError(error)
+        baseline = {}
+        if options['compare']:
+            with open(options['compare']) as baseline_file:
+                baseline = json.load(baseline_file)['scenarios']
+        try:
+            scenarios = benchmark.run(
+                options['scenarios'] or Benchmark.scenarios,
+                options['requests'], options['warmup'],
+            )
+        finally:
+            benchmark.cleanup()
+        self.write_table(scenarios, baseline)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump({
+                    'commit': git_commit(),
+                    'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                    'database': connection.vendor,
+                    'transport': options['url'] or 'test-client',
+                    'options': {
+                        name: options[name] for name in (
+                            'requests', 'warmup', 'concurrency', 'clients',
+                            'zipf', 'seed',
+                        )
+                    },
+                    'scenarios': scenarios,
+                }, output, indent=2)
+            self.stdout.write(f'Результаты сохранены в {options["output"]}')
+
+    def write_table(self, scenarios, baseline):
+        width = max(map(len, scenarios))
+        self.stdout.write(
+            'scenario'.ljust(width) + ''.join(
+                column.rjust(14) for column in COLUMNS
+            )
+        )
+        for name, result in scenarios.items():
+            cells = []
+            for column in COLUMNS:
+                cell = format_value(result[column])
+                old = baseline.get(name, {}).get(column)
+                if old and result[column] is not None and column.endswith(
+                    '_ms'
+                ):
+                    cell += f' ({(result[column] / old - 1) * 100:+.0f}%)'
+                cells.append(cell.rjust(14))
+            self.stdout.write(name.ljust(width) + ''.join(cells))
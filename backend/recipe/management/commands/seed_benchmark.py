@@ -0,0 +1,71 @@
+import os
+import random
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from recipe.benchmark import USER_PREFIX, DatasetBuilder
+from recipe.models import User
+
+DEFAULT_INGREDIENTS = os.path.join(
+    settings.BASE_DIR.parent, 'data', 'ingredients.csv'
+)
+
+
+class Command(BaseCommand):
+    help = 'Заполняет базу синтетическими данными для нагрузочных тестов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument('--tags', type=int, default=6,
+                            help='Сколько тэгов должно быть всего')
+        parser.add_argument(
+            '--ingredients-per-recipe', type=int, nargs=2, default=(3, 12),
+            metavar=('MIN', 'MAX'),
+        )
+        parser.add_argument('--follows', type=float, default=20,
+                            help='Подписок на пользователя в среднем')
+        parser.add_argument('--favorites', type=float, default=30,
+                            help='Избранных рецептов на пользователя')
+        parser.add_argument('--carts', type=float, default=8,
+                            help='Рецептов в корзине на пользователя')
+        parser.add_argument('--zipf', type=float, default=1.1,
+                            help='Показатель распределения популярности')
+        parser.add_argument('--days', type=int, default=365,
+                            help='За сколько дней распределить рецепты')
+        parser.add_argument(
+            '--ingredients',
+            default=(
+                DEFAULT_INGREDIENTS
+                if os.path.exists(DEFAULT_INGREDIENTS) else ''
+            ),
+            help='CSV с ингредиентами (пусто - только из базы)',
+        )
+        parser.add_argument('--password', default='benchmark')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=1,
+                            help='Зерно генератора случайных чисел')
+        parser.add_argument('--clear', action='store_true',
+                            help='Удалить данные прошлого запуска')
+
+    def handle(self, *args, **options):
+        if options['tags'] < 1:
+            raise CommandError('Нужен хотя бы один тэг')
+        low, high = options['ingredients_per_recipe']
+        if not 1 <= low <= high:
+            raise CommandError('Неверный диапазон ингредиентов')
+        previous = User.objects.filter(username__startswith=USER_PREFIX)
+        if previous.exists():
+            if not options['clear']:
+                raise CommandError(
+                    'Тестовые данные уже есть, используйте --clear'
+                )
+            self.stdout.write(f'Удалено: {previous.delete()[0]}')
+        try:
+            DatasetBuilder(
+                random.Random(options['seed']), options, self.stdout.write
+            ).build()
+        except ValueError as error:
+            raise CommandError(error)
+        self.stdout.write(self.style.SUCCESS('Готово'))
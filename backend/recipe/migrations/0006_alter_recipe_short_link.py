@@ -0,0 +1,18 @@
+# Generated by Django 3.2.16 on 2026-10-18 05:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0005_recipe_updated_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='short_link',
+            field=models.CharField(blank=True, max_length=256, null=True, unique=True, verbose_name='Короткая ссылка'),
+        ),
+    ]
@@ -0,0 +1,97 @@
+# Generated by Django 3.2.16 on 2026-10-18 05:30
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+FTS_TABLE = 'recipe_recipe_search'
+
+
+def normalize(text):
+    return text.replace('ё', 'е').replace('Ё', 'Е')
+
+
+def fill_ingredient_names(apps, schema_editor):
+    Recipe = apps.get_model('recipe', 'Recipe')
+    IngredientAmount = apps.get_model('recipe', 'IngredientAmount')
+    names = defaultdict(list)
+    amounts = IngredientAmount.objects.order_by('id').values_list(
+        'recipe_id', 'ingredient__name'
+    )
+    for recipe_id, name in amounts.iterator():
+        names[recipe_id].append(name)
+    recipes = []
+    for recipe in Recipe.objects.only('id').iterator():
+        recipe.ingredient_names = ', '.join(names[recipe.pk])
+        recipes.append(recipe)
+    Recipe.objects.bulk_update(recipes, ['ingredient_names'], batch_size=1000)
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        document = ' || '.join(
+            "setweight(to_tsvector('russian', "
+            f"translate(coalesce({column}, ''), 'ёЁ', 'еЕ')), '{weight}')"
+            for column, weight in (
+                ('name', 'A'), ('ingredient_names', 'B'), ('text', 'C')
+            )
+        )
+        schema_editor.execute(
+            'ALTER TABLE recipe_recipe ADD COLUMN search_vector tsvector '
+            f'GENERATED ALWAYS AS ({document}) STORED'
+        )
+        schema_editor.execute(
+            'CREATE INDEX recipe_recipe_search_vector_idx '
+            'ON recipe_recipe USING GIN (search_vector)'
+        )
+    elif connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA compile_options')
+            if 'ENABLE_FTS5' not in {row[0] for row in cursor.fetchall()}:
+                return
+        schema_editor.execute(
+            f'CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5('
+            "name, ingredient_names, text, "
+            "tokenize='unicode61 remove_diacritics 2')"
+        )
+        Recipe = apps.get_model('recipe', 'Recipe')
+        rows = [
+            (pk, normalize(name), normalize(ingredient_names), normalize(text))
+            for pk, name, ingredient_names, text in Recipe.objects.values_list(
+                'id', 'name', 'ingredient_names', 'text'
+            ).iterator()
+        ]
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} '
+                '(rowid, name, ingredient_names, text) VALUES (%s, %s, %s, %s)',
+                rows,
+            )
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        schema_editor.execute(
+            'ALTER TABLE recipe_recipe DROP COLUMN IF EXISTS search_vector'
+        )
+    elif connection.vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0007_recipe_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='ingredient_names',
+            field=models.TextField(blank=True, default='', editable=False, verbose_name='Названия ингредиентов'),
+        ),
+        migrations.RunPython(fill_ingredient_names, migrations.RunPython.noop),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 3.2.16 on 2026-10-18 05:15
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_tag_masks(apps, schema_editor):
+    Tag = apps.get_model('recipe', 'Tag')
+    Recipe = apps.get_model('recipe', 'Recipe')
+    tags = list(Tag.objects.order_by('id'))
+    if len(tags) > 63:
+        raise ValueError('Тэгов не может быть больше 63')
+    for bit, tag in enumerate(tags):
+        tag.bit = bit
+        tag.mask = 1 << bit
+    Tag.objects.bulk_update(tags, ['bit', 'mask'])
+    mask = Recipe.tags.through.objects.filter(
+        recipe_id=OuterRef('pk')
+    ).values('recipe_id').annotate(mask=Sum('tag__mask')).values('mask')
+    Recipe.objects.update(tags_mask=Coalesce(
+        Subquery(mask), Value(0), output_field=models.BigIntegerField()
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0008_recipe_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='tags_mask',
+            field=models.BigIntegerField(db_index=True, default=0, editable=False, verbose_name='Маска тэгов'),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='bit',
+            field=models.PositiveSmallIntegerField(editable=False, null=True, unique=True, verbose_name='Бит в маске тэгов'),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='mask',
+            field=models.BigIntegerField(default=0, editable=False, verbose_name='Маска'),
+        ),
+        migrations.RunPython(fill_tag_masks, migrations.RunPython.noop),
+    ]
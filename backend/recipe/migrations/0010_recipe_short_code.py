@@ -0,0 +1,56 @@
+# Generated by Django 3.2.16 on 2026-10-18 05:40
+
+import re
+import secrets
+import string
+
+from django.db import migrations, models
+
+import recipe.models
+
+CODE = re.compile(r'^[0-9A-Za-z]{1,16}$')
+ALPHABET = string.digits + string.ascii_letters
+LENGTH = 7
+
+
+def make_short_code():
+    return ''.join(secrets.choice(ALPHABET) for _ in range(LENGTH))
+
+
+def fill_short_codes(apps, schema_editor):
+    Recipe = apps.get_model('recipe', 'Recipe')
+    codes = set(Recipe.objects.exclude(
+        short_code=None
+    ).values_list('short_code', flat=True))
+    stale = []
+    for row in Recipe.objects.only('id', 'short_code').iterator():
+        if row.short_code and CODE.match(row.short_code):
+            continue
+        code = make_short_code()
+        while code in codes:
+            code = make_short_code()
+        codes.add(code)
+        row.short_code = code
+        stale.append(row)
+    Recipe.objects.bulk_update(stale, ['short_code'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0009_auto_20261018_0515'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='recipe',
+            old_name='short_link',
+            new_name='short_code',
+        ),
+        migrations.RunPython(fill_short_codes, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='recipe',
+            name='short_code',
+            field=models.CharField(default=recipe.models.make_short_code, editable=False, max_length=16, unique=True, verbose_name='Код короткой ссылки'),
+        ),
+    ]
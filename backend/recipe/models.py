@@ -1,14 +1,50 @@
-from django.db import models
+import secrets
+import string
+from collections import defaultdict
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import (
+    Exists,
+    F,
+    OuterRef,
+    Prefetch,
+    Subquery,
+    Sum,
+    Value,
+    Window,
+)
+from django.db.models.functions import Coalesce, RowNumber
+from django.core.exceptions import ValidationError
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.contrib.auth import get_user_model
 
 
 User = get_user_model()
 
+# Recipe.tags_mask is a signed BigIntegerField, so bits 0-62 are usable.
+TAG_BITS = 63
+SHORT_CODE_ALPHABET = string.digits + string.ascii_letters
+SHORT_CODE_LENGTH = 7
+SHORT_CODE_ATTEMPTS = 5
+
+
+def make_short_code():
+    """A random base62 code, assigned before the row is inserted."""
+    return ''.join(
+        secrets.choice(SHORT_CODE_ALPHABET) for _ in range(SHORT_CODE_LENGTH)
+    )
+
 
 class Tag(models.Model):
     name = models.CharField('название', max_length=32,)
     slug = models.SlugField('слаг', max_length=32, unique=True)
+    bit = models.PositiveSmallIntegerField(
+        'Бит в маске тэгов',
+        unique=True,
+        null=True,
+        editable=False,
+    )
+    mask = models.BigIntegerField('Маска', default=0, editable=False)
 
     class Meta:
         default_related_name = 'tag'
@@ -18,6 +54,23 @@ class Tag(models.Model):
     def __str__(self):
         return self.name
 
+    @classmethod
+    def free_bit(cls):
+        used = set(cls.objects.exclude(bit=None).values_list('bit', flat=True))
+        return next((bit for bit in range(TAG_BITS) if bit not in used), None)
+
+    def clean(self):
+        if self.bit is None and self.free_bit() is None:
+            raise ValidationError(f'Тэгов не может быть больше {TAG_BITS}')
+
+    def save(self, *args, **kwargs):
+        if self.bit is None:
+            self.bit = self.free_bit()
+            if self.bit is None:
+                raise ValueError(f'Тэгов не может быть больше {TAG_BITS}')
+            self.mask = 1 << self.bit
+        super().save(*args, **kwargs)
+
 
 class Ingredient(models.Model):
     name = models.CharField('название', max_length=128,)
@@ -38,6 +91,86 @@ class Ingredient(models.Model):
         return self.name
 
 
+class RecipeQuerySet(models.QuerySet):
+
+    def filter_tags(self, tags, match_all=False):
+        """Recipes with any (or all) of `tags`, via a bitwise predicate.
+        """
+        mask = sum(tag.mask for tag in tags)
+        if not mask:
+            return self
+        recipes = self.alias(matched_tags=F('tags_mask').bitand(mask))
+        if match_all:
+            return recipes.filter(matched_tags=mask)
+        return recipes.exclude(matched_tags=0)
+
+    def update_tags_mask(self, **fields):
+        """Recomputes tags_mask from the M2M rows in a single UPDATE."""
+        through = self.model.tags.through
+        mask = through.objects.filter(
+            recipe_id=OuterRef('pk')
+        ).values('recipe_id').annotate(mask=Sum('tag__mask')).values('mask')
+        return self.update(
+            tags_mask=Coalesce(
+                Subquery(mask), Value(0), output_field=models.BigIntegerField()
+            ),
+            **fields
+        )
+
+    def with_user_flags(self, user):
+        if user.is_anonymous:
+            return self.annotate(
+                is_favorited=Value(False, models.BooleanField()),
+                is_in_shopping_cart=Value(False, models.BooleanField()),
+            )
+        return self.annotate(
+            is_favorited=Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            )),
+            is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            )),
+        )
+
+    def with_related(self, user):
+        authors = User.objects.all()
+        if user.is_authenticated:
+            authors = authors.annotate(is_subscribed=Exists(
+                Follow.objects.filter(user=user, following=OuterRef('pk'))
+            ))
+        return self.with_user_flags(user).prefetch_related(
+            Prefetch('author', queryset=authors),
+            'tags',
+            Prefetch(
+                'ingredient_in_recipe',
+                queryset=IngredientAmount.objects.select_related('ingredient')
+            ),
+        )
+
+    def latest_by_author(self, author_ids, limit=None):
+        grouped = defaultdict(list)
+        if not author_ids:
+            return grouped
+        recipes = self.filter(author_id__in=author_ids).order_by(
+            '-pub_date', '-id'
+        )
+        if limit is not None:
+            ranked = recipes.annotate(position=Window(
+                expression=RowNumber(),
+                partition_by=[F('author_id')],
+                order_by=[F('pub_date').desc(), F('id').desc()],
+            )).order_by()
+            sql, params = ranked.query.sql_with_params()
+            recipes = self.raw(
+                f'SELECT * FROM ({sql}) ranked WHERE position <= %s '
+                'ORDER BY pub_date DESC, id DESC',
+                (*params, limit),
+            )
+        for recipe in recipes:
+            grouped[recipe.author_id].append(recipe)
+        return grouped
+
+
 class Recipe(models.Model):
     tags = models.ManyToManyField(Tag, verbose_name='Тэг',)
     author = models.ForeignKey(
@@ -52,7 +185,19 @@ class Recipe(models.Model):
     )
     name = models.CharField('название', max_length=256,)
     image = models.ImageField('Картинака', upload_to='recipe/images/',)
+    image_variants = models.JSONField(
+        'Варианты картинки',
+        default=dict,
+        blank=True,
+        editable=False,
+    )
     text = models.TextField('описание',)
+    ingredient_names = models.TextField(
+        'Названия ингредиентов',
+        blank=True,
+        default='',
+        editable=False,
+    )
     cooking_time = models.SmallIntegerField(
         'время приготовления',
         default=1,
@@ -61,12 +206,33 @@ class Recipe(models.Model):
             MinValueValidator(1)
         ]
     )
+    tags_mask = models.BigIntegerField(
+        'Маска тэгов',
+        default=0,
+        db_index=True,
+        editable=False,
+    )
     pub_date = models.DateTimeField('Дата публикации', auto_now_add=True)
-    short_link = models.CharField(
-        'Короткая ссылка',
-        max_length=256,
-        unique=True
+    updated_at = models.DateTimeField('Дата изменения', auto_now=True)
+    short_code = models.CharField(
+        'Код короткой ссылки',
+        max_length=16,
+        unique=True,
+        default=make_short_code,
+        editable=False,
     )
+    favorites_count = models.PositiveIntegerField(
+        'В избранном',
+        default=0,
+        editable=False,
+    )
+    shopping_cart_count = models.PositiveIntegerField(
+        'В корзинах',
+        default=0,
+        editable=False,
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         default_related_name = 'recipes'
@@ -77,6 +243,42 @@ class Recipe(models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        """Inserts a new recipe, drawing another short code if the random
+        one is taken.
+        """
+        if not self._state.adding:
+            return super().save(*args, **kwargs)
+        for attempt in range(SHORT_CODE_ATTEMPTS):
+            try:
+                with transaction.atomic(using=kwargs.get('using')):
+                    return super().save(*args, **kwargs)
+            except IntegrityError:
+                if attempt == SHORT_CODE_ATTEMPTS - 1 or not (
+                    Recipe.objects.filter(short_code=self.short_code).exists()
+                ):
+                    raise
+                self.short_code = make_short_code()
+
+
+class IngredientAmountQuerySet(models.QuerySet):
+
+    def write(self, recipe_ids, delete=(), create=(), update=()):
+        """The one way to change amounts in bulk: deletes the rows with
+        pks in `delete`, inserts `create` and saves `amount` of `update`,
+        keeping carts, caches and derived fields of `recipe_ids` in step.
+        """
+        from recipe.shopping_list import recipes_changing
+        from recipe.signals import amounts_changed
+        with recipes_changing(recipe_ids):
+            if delete:
+                self.filter(pk__in=delete).delete()
+            if create:
+                self.bulk_create(create)
+            if update:
+                self.bulk_update(update, ['amount'])
+        amounts_changed(recipe_ids)
+
 
 class IngredientAmount(models.Model):
     recipe = models.ForeignKey(
@@ -94,6 +296,8 @@ class IngredientAmount(models.Model):
         default=1,
     )
 
+    objects = IngredientAmountQuerySet.as_manager()
+
     class Meta:
         default_related_name = 'ingredient_in_recipe'
         verbose_name = 'ингридиент в рецепте'
@@ -183,3 +387,113 @@ class Favorite(models.Model):
 
     def __str__(self):
         return f'{self.user} {self.recipe}'
+
+
+class FeedEntry(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Читатель',
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='рецепт',
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='автор',
+    )
+    pub_date = models.DateTimeField('Дата публикации')
+
+    class Meta:
+        verbose_name = 'запись ленты'
+        verbose_name_plural = 'Лента подписок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_feed_entry'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-recipe'],
+                name='feed_user_pub_date_idx',
+            ),
+            models.Index(
+                fields=['user', 'author'],
+                name='feed_user_author_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.user} {self.recipe}'
+
+
+class RecipeNeighbor(models.Model):
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='neighbors',
+        verbose_name='рецепт',
+    )
+    neighbor = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='похожий рецепт',
+    )
+    score = models.FloatField('Сходство')
+
+    class Meta:
+        verbose_name = 'похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipe', 'neighbor'],
+                name='unique_recipe_neighbor'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['recipe', '-score'],
+                name='neighbor_recipe_score_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.recipe} {self.neighbor}'
+
+
+class ShoppingListItem(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_items',
+        verbose_name='Пользователь',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Ингредиент',
+    )
+    total_amount = models.BigIntegerField('Количество')
+    recipe_count = models.IntegerField('Рецептов')
+
+    class Meta:
+        verbose_name = 'строка списка покупок'
+        verbose_name_plural = 'Списки покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_list_item'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user} {self.ingredient} {self.total_amount}'
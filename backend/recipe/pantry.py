@@ -0,0 +1,171 @@
+import heapq
+import threading
+import time
+from array import array
+from collections import Counter
+from itertools import compress, repeat
+from operator import and_, eq, ge, le, truediv
+
+from django.conf import settings
+from django.db import connection
+
+from api.cache import get_generation
+from recipe.models import IngredientAmount, Recipe
+
+CHECK_INTERVAL = 1.0
+
+
+class Ranking:
+    """Matches of a pantry query, ordered only as far as a page needs.
+
+    Works as a sequence for LimitOffsetPagination: `len` is the number
+    of matches, and a slice only builds sort keys for the recipes whose
+    coverage reaches that of the slice's last place.
+    """
+
+    def __init__(self, index, positions, counts):
+        self.index = index
+        self.positions = positions
+        self.counts = counts
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __getitem__(self, item):
+        sizes = list(map(self.index.sizes.__getitem__, self.positions))
+        coverage = list(map(truediv, self.counts, sizes))
+        selected = range(len(coverage))
+        if 0 < item.stop < len(coverage):
+            threshold = heapq.nlargest(item.stop, coverage)[-1]
+            selected = compress(selected, map(ge, coverage, repeat(threshold)))
+        ids = self.index.ids
+        return heapq.nlargest(item.stop, (
+            (coverage[i], self.counts[i] - sizes[i], self.counts[i],
+             ids[self.positions[i]])
+            for i in selected
+        ))[item]
+
+
+class PantryIndex:
+    """Recipes by ingredient, for ranking by how much of a recipe is held.
+
+    Recipes are numbered by their place in id order. Ingredient counts,
+    cooking times and tags masks are kept in parallel arrays of machine
+    ints. Each ingredient maps to the sorted list of the numbers of the
+    recipes that use it; these are lists rather than arrays because
+    reading an array boxes every item, which made counting 2-3 times
+    slower, and all lists share one int object per recipe, so an entry
+    still costs one pointer.
+    """
+
+    def __init__(self, recipes, amounts):
+        self.ids = array('q')
+        self.sizes = array('H')
+        self.cooking_times = array('h')
+        self.tags_masks = array('q')
+        self.postings = {}
+        positions = {}
+        for position, (pk, cooking_time, tags_mask) in enumerate(recipes):
+            positions[pk] = position
+            self.ids.append(pk)
+            self.sizes.append(0)
+            self.cooking_times.append(cooking_time)
+            self.tags_masks.append(tags_mask)
+        for recipe_id, ingredient_id in amounts:
+            position = positions.get(recipe_id)
+            if position is None:
+                continue
+            self.sizes[position] += 1
+            if ingredient_id not in self.postings:
+                self.postings[ingredient_id] = []
+            self.postings[ingredient_id].append(position)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def rank(self, ingredient_ids, any_tags=0, all_tags=0,
+             max_cooking_time=None):
+        """Recipes using any of `ingredient_ids`, best covered first.
+
+        Matches are (coverage, -missing, held, id) tuples: the share of
+        the recipe's ingredients that are held, then fewer missing ones,
+        then newer recipes. Every step over all the matches is a map or
+        compress of builtins, so none runs Python code per recipe.
+        """
+        held = Counter()
+        for pk in set(ingredient_ids):
+            held.update(self.postings.get(pk, ()))
+        positions = list(held)
+        if any_tags:
+            positions = list(compress(positions, map(
+                and_, map(self.tags_masks.__getitem__, positions),
+                repeat(any_tags),
+            )))
+        if all_tags:
+            positions = list(compress(positions, map(
+                eq,
+                map(and_, map(self.tags_masks.__getitem__, positions),
+                    repeat(all_tags)),
+                repeat(all_tags),
+            )))
+        if max_cooking_time is not None:
+            positions = list(compress(positions, map(
+                le, map(self.cooking_times.__getitem__, positions),
+                repeat(max_cooking_time),
+            )))
+        return Ranking(
+            self, positions, list(map(held.__getitem__, positions))
+        )
+
+
+def build_index():
+    return PantryIndex(
+        Recipe.objects.order_by('id').values_list(
+            'id', 'cooking_time', 'tags_mask'
+        ).iterator(),
+        IngredientAmount.objects.order_by().values_list(
+            'recipe_id', 'ingredient_id'
+        ).iterator(),
+    )
+
+
+_index = None
+_generation = None
+_checked_at = 0.0
+_built_at = 0.0
+_lock = threading.Lock()
+
+
+def get_index():
+    """The process's index, or None until its first build is done.
+
+    When the 'recipes' generation moves, at most once per
+    PANTRY_REFRESH_INTERVAL, a background thread builds a new index and
+    swaps it in; requests keep answering from the old one meanwhile.
+    """
+    global _checked_at
+    now = time.monotonic()
+    if now - _checked_at < CHECK_INTERVAL or _index is not None and (
+        now - _built_at < settings.PANTRY_REFRESH_INTERVAL
+    ):
+        return _index
+    _checked_at = now
+    generation = get_generation('recipes')
+    if (_index is None or generation != _generation) and _lock.acquire(
+        blocking=False
+    ):
+        threading.Thread(
+            target=rebuild, args=(generation,), daemon=True
+        ).start()
+    return _index
+
+
+def rebuild(generation):
+    global _index, _generation, _built_at
+    try:
+        _index = build_index()
+        _generation = generation
+        _built_at = time.monotonic()
+    finally:
+        connection.close()
+        _lock.release()
@@ -0,0 +1,306 @@
+import os
+import struct
+import zlib
+from functools import lru_cache
+
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+MARGIN = 50
+
+
+class TrueTypeFont:
+    """The parts of a TrueType file needed to embed it as a CID font."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as font_file:
+            self.data = font_file.read()
+        self.name = ''.join(
+            char for char in os.path.splitext(os.path.basename(path))[0]
+            if char.isalnum()
+        ) or 'Font'
+        self.tables = self.read_tables()
+        (self.units_per_em,) = self.unpack('head', 18, '>H')
+        self.bbox = self.scale(*self.unpack('head', 36, '>4h'))
+        self.ascent, self.descent = self.scale(
+            *self.unpack('hhea', 4, '>2h')
+        )
+        (metrics_count,) = self.unpack('hhea', 34, '>H')
+        (glyphs_count,) = self.unpack('maxp', 4, '>H')
+        offset = self.tables['hmtx'][0]
+        advances = [
+            struct.unpack_from('>H', self.data, offset + 4 * index)[0]
+            for index in range(metrics_count)
+        ]
+        advances += [advances[-1]] * (glyphs_count - metrics_count)
+        self.widths = self.scale(*advances)
+        self.glyphs = self.read_cmap()
+
+    def read_tables(self):
+        (count,) = struct.unpack_from('>H', self.data, 4)
+        tables = {}
+        for index in range(count):
+            tag, _, offset, length = struct.unpack_from(
+                '>4sLLL', self.data, 12 + 16 * index
+            )
+            tables[tag.decode('latin-1')] = (offset, length)
+        return tables
+
+    def unpack(self, table, offset, fmt):
+        start = self.tables[table][0]
+        return struct.unpack_from(fmt, self.data, start + offset)
+
+    def scale(self, *values):
+        return [round(value * 1000 / self.units_per_em) for value in values]
+
+    def read_cmap(self):
+        start = self.tables['cmap'][0]
+        _, count = struct.unpack_from('>HH', self.data, start)
+        subtables = {}
+        for index in range(count):
+            platform, encoding, offset = struct.unpack_from(
+                '>HHL', self.data, start + 4 + 8 * index
+            )
+            subtables[platform, encoding] = start + offset
+        if (3, 10) in subtables:
+            return self.read_cmap_format12(subtables[3, 10])
+        if (3, 1) in subtables:
+            return self.read_cmap_format4(subtables[3, 1])
+        raise ValueError('В шрифте нет юникодной таблицы cmap')
+
+    def read_cmap_format4(self, offset):
+        (segments,) = struct.unpack_from('>H', self.data, offset + 6)
+        segments //= 2
+        ends = offset + 14
+        starts = ends + 2 * segments + 2
+        deltas = starts + 2 * segments
+        range_offsets = deltas + 2 * segments
+        glyphs = {}
+        for index in range(segments):
+            (end,) = struct.unpack_from('>H', self.data, ends + 2 * index)
+            (first,) = struct.unpack_from('>H', self.data, starts + 2 * index)
+            (delta,) = struct.unpack_from('>h', self.data, deltas + 2 * index)
+            position = range_offsets + 2 * index
+            (range_offset,) = struct.unpack_from('>H', self.data, position)
+            for code in range(first, min(end, 0xFFFE) + 1):
+                if range_offset:
+                    (glyph,) = struct.unpack_from(
+                        '>H', self.data,
+                        position + range_offset + 2 * (code - first)
+                    )
+                    if glyph:
+                        glyph = (glyph + delta) % 0x10000
+                else:
+                    glyph = (code + delta) % 0x10000
+                if glyph:
+                    glyphs[code] = glyph
+        return glyphs
+
+    def read_cmap_format12(self, offset):
+        (groups,) = struct.unpack_from('>L', self.data, offset + 12)
+        glyphs = {}
+        for index in range(groups):
+            first, last, glyph = struct.unpack_from(
+                '>LLL', self.data, offset + 16 + 12 * index
+            )
+            for code in range(first, last + 1):
+                glyphs[code] = glyph + code - first
+        return glyphs
+
+    @property
+    def compressed(self):
+        if not hasattr(self, '_compressed'):
+            self._compressed = zlib.compress(self.data)
+        return self._compressed
+
+    def text_width(self, text, size):
+        return sum(
+            self.widths[self.glyphs.get(ord(char), 0)] for char in text
+        ) * size / 1000
+
+
+@lru_cache(maxsize=None)
+def load_font(path):
+    return TrueTypeFont(path)
+
+
+class PdfDocument:
+    """Streams a plain text document as a PDF with an embedded font.
+
+    Pages are written as soon as they are filled, the font objects go at
+    the end because their widths and ToUnicode map only cover the glyphs
+    that were actually used.
+    """
+    catalog, pages, type0, cid_font, descriptor, to_unicode, font_file = (
+        range(1, 8)
+    )
+
+    def __init__(self, font, size=12, title_size=16, leading=1.4):
+        self.font = font
+        self.size = size
+        self.title_size = title_size
+        self.leading = round(size * leading)
+        self.offsets = {}
+        self.position = 0
+        self.page_ids = []
+        self.used = {}
+
+    def render(self, title, lines):
+        yield self.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        yield self.write_object(
+            self.catalog, b'<< /Type /Catalog /Pages 2 0 R >>'
+        )
+        page = [self.heading(title)]
+        height = PAGE_HEIGHT - 2 * MARGIN - self.title_size
+        per_page = int(height // self.leading) + 1
+        for line in lines:
+            for part in self.wrap(line):
+                if len(page) >= per_page:
+                    yield self.write_page(page)
+                    page = []
+                page.append(self.encode(part) + b' Tj T*')
+        yield self.write_page(page)
+        yield self.write_font()
+        yield self.write_object(self.pages, (
+            '<< /Type /Pages /Count {} /Kids [{}] >>'.format(
+                len(self.page_ids),
+                ' '.join(f'{page_id} 0 R' for page_id in self.page_ids)
+            )
+        ).encode())
+        yield self.write_trailer()
+
+    def heading(self, title):
+        return b'/F1 %d Tf %s Tj T* /F1 %d Tf' % (
+            self.title_size, self.encode(title), self.size
+        )
+
+    def wrap(self, line):
+        width = PAGE_WIDTH - 2 * MARGIN
+        while self.font.text_width(line, self.size) > width:
+            cut = len(line) - 1
+            while cut > 1 and self.font.text_width(
+                line[:cut], self.size
+            ) > width:
+                cut -= 1
+            space = line.rfind(' ', 0, cut)
+            cut = space if space > 0 else cut
+            yield line[:cut]
+            line = '  ' + line[cut:].lstrip()
+        yield line
+
+    def encode(self, text):
+        glyphs = []
+        for char in text:
+            glyph = self.font.glyphs.get(ord(char), 0)
+            self.used.setdefault(glyph, char)
+            glyphs.append(glyph)
+        return b'<%s>' % ''.join(f'{glyph:04X}' for glyph in glyphs).encode()
+
+    def next_id(self):
+        return max(self.font_file, *self.offsets) + 1
+
+    def write(self, data):
+        self.position += len(data)
+        return data
+
+    def write_object(self, object_id, body):
+        self.offsets[object_id] = self.position
+        return self.write(b'%d 0 obj\n%s\nendobj\n' % (object_id, body))
+
+    def write_stream(self, object_id, content, extra=b''):
+        return self.write_object(object_id, b'<< /Length %d%s >>\n'
+                                 b'stream\n%s\nendstream' % (
+                                     len(content), extra, content))
+
+    def write_page(self, lines):
+        content_id = self.next_id()
+        page_id = content_id + 1
+        content = b'BT\n/F1 %d Tf %d TL %d %d Td\n%s\nET' % (
+            self.size, self.leading, MARGIN, PAGE_HEIGHT - MARGIN - self.size,
+            b'\n'.join(lines)
+        )
+        chunk = self.write_stream(
+            content_id, zlib.compress(content), b' /Filter /FlateDecode'
+        )
+        self.page_ids.append(page_id)
+        return chunk + self.write_object(page_id, (
+            '<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {} {}] '
+            '/Resources << /Font << /F1 {} 0 R >> >> /Contents {} 0 R >>'
+        ).format(PAGE_WIDTH, PAGE_HEIGHT, self.type0, content_id).encode())
+
+    def write_font(self):
+        font = self.font
+        name = font.name.encode()
+        glyphs = sorted(self.used)
+        widths = ' '.join(
+            f'{glyph} [{font.widths[glyph]}]' for glyph in glyphs
+        )
+        chunks = [
+            self.write_object(self.type0, (
+                b'<< /Type /Font /Subtype /Type0 /BaseFont /%s '
+                b'/Encoding /Identity-H /DescendantFonts [%d 0 R] '
+                b'/ToUnicode %d 0 R >>'
+            ) % (name, self.cid_font, self.to_unicode)),
+            self.write_object(self.cid_font, (
+                b'<< /Type /Font /Subtype /CIDFontType2 /BaseFont /%s '
+                b'/CIDSystemInfo << /Registry (Adobe) /Ordering (Identity) '
+                b'/Supplement 0 >> /FontDescriptor %d 0 R '
+                b'/CIDToGIDMap /Identity /DW 1000 /W [%s] >>'
+            ) % (name, self.descriptor, widths.encode())),
+            self.write_object(self.descriptor, (
+                '<< /Type /FontDescriptor /FontName /{} /Flags 32 '
+                '/FontBBox [{}] /ItalicAngle 0 /Ascent {} /Descent {} '
+                '/CapHeight {} /StemV 80 /FontFile2 {} 0 R >>'
+            ).format(
+                font.name, ' '.join(map(str, font.bbox)), font.ascent,
+                font.descent, font.ascent, self.font_file
+            ).encode()),
+            self.write_stream(self.to_unicode, self.to_unicode_cmap(glyphs)),
+            self.write_stream(
+                self.font_file, font.compressed,
+                b' /Length1 %d /Filter /FlateDecode' % len(font.data)
+            ),
+        ]
+        return b''.join(chunks)
+
+    def to_unicode_cmap(self, glyphs):
+        lines = [
+            '/CIDInit /ProcSet findresource begin',
+            '12 dict begin',
+            'begincmap',
+            '/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) '
+            '/Supplement 0 >> def',
+            '/CMapName /Adobe-Identity-UCS def',
+            '/CMapType 2 def',
+            '1 begincodespacerange',
+            '<0000> <FFFF>',
+            'endcodespacerange',
+        ]
+        for start in range(0, len(glyphs), 100):
+            block = glyphs[start:start + 100]
+            lines.append(f'{len(block)} beginbfchar')
+            lines.extend(
+                '<{:04X}> <{}>'.format(
+                    glyph, self.used[glyph].encode('utf-16-be').hex().upper()
+                )
+                for glyph in block
+            )
+            lines.append('endbfchar')
+        lines += [
+            'endcmap',
+            'CMapName currentdict /CMap defineresource pop',
+            'end',
+            'end',
+        ]
+        return '\n'.join(lines).encode()
+
+    def write_trailer(self):
+        size = max(self.offsets) + 1
+        xref_position = self.position
+        entries = [b'0000000000 65535 f \n']
+        for object_id in range(1, size):
+            entries.append(b'%010d 00000 n \n' % self.offsets[object_id])
+        return self.write(
+            b'xref\n0 %d\n%s' % (size, b''.join(entries))
+            + b'trailer\n<< /Size %d /Root 1 0 R >>\n' % size
+            + b'startxref\n%d\n%%%%EOF\n' % xref_position
+        )
@@ -0,0 +1,152 @@
+import re
+from collections import defaultdict
+
+from django.db import connections
+from django.db.models import FloatField, Q
+from django.db.models.expressions import RawSQL
+
+from api.cache import bump_generation
+from jobs.queue import job
+from recipe.models import IngredientAmount, Recipe
+
+SEARCH_CONFIG = 'russian'
+FTS_TABLE = 'recipe_recipe_search'
+# bm25() weights of the name, ingredient_names and text columns.
+FTS_WEIGHTS = (10.0, 5.0, 1.0)
+REFRESH_BATCH_SIZE = 1000
+INDEXED_FIELDS = {'name', 'ingredient_names', 'text'}
+WORD = re.compile(r'\w+')
+
+_fts_tables = {}
+
+
+def normalize(text):
+    return text.replace('ё', 'е').replace('Ё', 'Е')
+
+
+def join_names(names):
+    return ', '.join(names)
+
+
+def has_fts_table(alias):
+    if alias not in _fts_tables:
+        connection = connections[alias]
+        _fts_tables[alias] = (
+            connection.vendor == 'sqlite'
+            and FTS_TABLE in connection.introspection.table_names()
+        )
+    return _fts_tables[alias]
+
+
+def search_recipes(queryset, value):
+    """Recipes matching `value`, best matches first.
+
+    PostgreSQL matches the generated `search_vector` column (GIN index,
+    Russian stemming), SQLite the FTS5 table, anything else falls back to
+    icontains. Cursor pagination orders by date, so ranking applies to
+    limit/offset pages.
+    """
+    value = normalize(value.strip())
+    if not value:
+        return queryset
+    table = Recipe._meta.db_table
+    vendor = connections[queryset.db].vendor
+    if vendor == 'postgresql':
+        query = f"websearch_to_tsquery('{SEARCH_CONFIG}', %s)"
+        rank = RawSQL(
+            f'ts_rank_cd({table}.search_vector, {query})', (value,),
+            output_field=FloatField(),
+        )
+        queryset = queryset.extra(
+            where=[f'{table}.search_vector @@ {query}'], params=[value]
+        )
+    elif has_fts_table(queryset.db):
+        match = ' '.join(f'"{word}"*' for word in WORD.findall(value))
+        if not match:
+            return queryset.none()
+        weights = ', '.join(map(str, FTS_WEIGHTS))
+        rank = RawSQL(
+            f'SELECT -bm25({FTS_TABLE}, {weights}) FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s AND rowid = {table}.id',
+            (match,), output_field=FloatField(),
+        )
+        queryset = queryset.extra(
+            where=[
+                f'{table}.id IN (SELECT rowid FROM {FTS_TABLE} '
+                f'WHERE {FTS_TABLE} MATCH %s)'
+            ],
+            params=[match],
+        )
+    else:
+        return queryset.filter(
+            Q(name__icontains=value)
+            | Q(ingredient_names__icontains=value)
+            | Q(text__icontains=value)
+        )
+    return queryset.annotate(search_rank=rank).order_by(
+        '-search_rank', '-pub_date', '-id'
+    )
+
+
+def index_recipes(recipes, using='default'):
+    """Copies recipes into the SQLite FTS table; PostgreSQL needs nothing.
+    """
+    if not has_fts_table(using):
+        return
+    rows = [
+        (recipe.pk, normalize(recipe.name),
+         normalize(recipe.ingredient_names), normalize(recipe.text))
+        for recipe in recipes
+    ]
+    with connections[using].cursor() as cursor:
+        cursor.executemany(
+            f'INSERT OR REPLACE INTO {FTS_TABLE} '
+            '(rowid, name, ingredient_names, text) VALUES (%s, %s, %s, %s)',
+            rows,
+        )
+
+
+def unindex_recipes(pks, using='default'):
+    if not has_fts_table(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.executemany(
+            f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+            [(pk,) for pk in pks],
+        )
+
+
+def refresh_ingredient_names(pks):
+    """Rebuilds Recipe.ingredient_names (and the index) for `pks`."""
+    names = defaultdict(list)
+    amounts = IngredientAmount.objects.filter(
+        recipe_id__in=pks
+    ).order_by('id').values_list('recipe_id', 'ingredient__name')
+    for recipe_id, name in amounts:
+        names[recipe_id].append(name)
+    recipes = list(
+        Recipe.objects.filter(pk__in=pks).only('id', 'name', 'text')
+    )
+    for recipe in recipes:
+        recipe.ingredient_names = join_names(names[recipe.pk])
+    Recipe.objects.bulk_update(
+        recipes, ['ingredient_names'], batch_size=REFRESH_BATCH_SIZE
+    )
+    index_recipes(recipes)
+    return recipes
+
+
+@job
+def refresh_recipes(pks):
+    for start in range(0, len(pks), REFRESH_BATCH_SIZE):
+        refresh_ingredient_names(pks[start:start + REFRESH_BATCH_SIZE])
+    bump_generation('recipes')
+
+
+@job
+def refresh_ingredient(ingredient_id):
+    """Picks up a renamed ingredient in every recipe that uses it."""
+    pks = list(IngredientAmount.objects.filter(
+        ingredient_id=ingredient_id
+    ).order_by('recipe_id').values_list('recipe_id', flat=True).distinct())
+    refresh_recipes(pks)
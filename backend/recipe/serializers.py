@@ -1,6 +1,13 @@
+from django.db import transaction
+from django.http import QueryDict
 from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS
 from users.serializers import UserSerializer
-from api.utils import Base64ImageField
+from api.utils import (
+    Base64ImageField,
+    ImageVariantsField,
+    parse_form_data,
+)
 from recipe.models import (
     Tag,
     Ingredient,
@@ -9,6 +16,10 @@ from recipe.models import (
     Favorite,
     ShoppingCart
 )
+from recipe.search import join_names
+
+BATCH_SIZE = 500
+PANTRY_SIZE = 100
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -41,11 +52,6 @@ class IngredientInRecipeSerializer(serializers.Serializer):
     id = serializers.IntegerField()
     amount = serializers.IntegerField(write_only=True)
 
-    def validate_id(self, value):
-        if Ingredient.objects.filter(id=value).exists():
-            return value
-        raise serializers.ValidationError('Ингидиент отсутствует')
-
     def validate_amount(self, value):
         if value <= 0:
             raise serializers.ValidationError(
@@ -54,7 +60,31 @@ class IngredientInRecipeSerializer(serializers.Serializer):
         return value
 
 
+class RecipeTagListField(serializers.ManyRelatedField):
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        try:
+            ids = [int(pk) for pk in data]
+        except (TypeError, ValueError):
+            raise serializers.ValidationError('Тэг отсутствует')
+        tags = Tag.objects.in_bulk(ids)
+        if len(tags) != len(set(ids)):
+            raise serializers.ValidationError('Тэг отсутствует')
+        return [tags[pk] for pk in ids]
+
+
 class RecipeTagField(serializers.RelatedField):
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return RecipeTagListField(**list_kwargs)
+
     def to_representation(self, value):
         return TagSerializer(value).data
 
@@ -98,6 +128,8 @@ class СommonRecipeSerializer(serializers.ModelSerializer):
         )
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         if self.context['request'].user.is_authenticated:
             return Favorite.objects.filter(
                 user=self.context['request'].user,
@@ -106,6 +138,8 @@ class СommonRecipeSerializer(serializers.ModelSerializer):
         return False
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         if self.context['request'].user.is_authenticated:
             return ShoppingCart.objects.filter(
                 user=self.context['request'].user,
@@ -119,27 +153,47 @@ class RecipeCreateSerializer(СommonRecipeSerializer):
     ingredients = IngredientInRecipeSerializer(many=True,)
     cooking_time = serializers.IntegerField(min_value=1, max_value=5000)
 
+    def to_internal_value(self, data):
+        if isinstance(data, QueryDict):
+            data = parse_form_data(data, json_fields=('tags', 'ingredients'))
+        return super().to_internal_value(data)
+
+    @transaction.atomic
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
-        recipe = Recipe.objects.create(**validated_data)
-        recipe.short_link = 'https://{}/{}'.format(
-            'foodgram-12.zapto.org/recipes',
-            recipe.id
+        recipe = Recipe.objects.create(
+            ingredient_names=join_names(
+                ingredient['name'] for ingredient in ingredients
+            ),
+            tags_mask=sum(tag.mask for tag in tags),
+            **validated_data
         )
-        recipe.save()
-        recipe.tags.set(tags)
+        Recipe.tags.through.objects.bulk_create([
+            Recipe.tags.through(recipe=recipe, tag=tag) for tag in tags
+        ])
         list_ing = [
             IngredientAmount(
                 recipe=recipe,
-                ingredient=Ingredient.objects.get(id=ingredient['id']),
+                ingredient_id=ingredient['id'],
                 amount=ingredient['amount']
             ) for ingredient in ingredients
         ]
+        # A new recipe is in no cart yet, and its own post_save has
+        # indexed its names and queued its neighbours.
         IngredientAmount.objects.bulk_create(list_ing)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
+        """Writes only what differs from the stored recipe.
+
+        Tags and ingredient amounts are diffed against the current rows,
+        and nothing is saved at all if the submitted data matches them.
+        What gets invalidated follows from what is written: the recipe's
+        receivers look at update_fields, and amounts go through
+        IngredientAmount.objects.write().
+        """
         if validated_data.get(
             'ingredients'
         ) is None or validated_data.get(
@@ -148,22 +202,88 @@ class RecipeCreateSerializer(СommonRecipeSerializer):
             raise serializers.ValidationError('Не заполнены обязательные поля')
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
-        instance.ingredients.clear()
-        instance.tags.set(tags)
-        list_ing = [
-            IngredientAmount(
-                recipe=instance,
-                ingredient=Ingredient.objects.get(id=ingredient['id']),
-                amount=ingredient['amount']
-            ) for ingredient in ingredients
+        changed = [
+            name for name, value in validated_data.items()
+            if name == 'image' or getattr(instance, name) != value
         ]
-        IngredientAmount.objects.bulk_create(list_ing)
-        return super().update(instance, validated_data)
+        for name in changed:
+            setattr(instance, name, validated_data[name])
+        if self.update_tags(instance, tags):
+            instance.tags_mask = sum(tag.mask for tag in tags)
+            changed.append('tags_mask')
+        if self.update_ingredients(instance, ingredients):
+            instance.ingredient_names = join_names(
+                ingredient['name'] for ingredient in sorted(
+                    ingredients, key=lambda ingredient: ingredient['order']
+                )
+            )
+        if changed:
+            instance.save(update_fields=[*changed, 'updated_at'])
+        return instance
+
+    def update_tags(self, instance, tags):
+        through = Recipe.tags.through
+        current = {tag.pk for tag in instance.tags.all()}
+        new = {tag.pk for tag in tags}
+        if current == new:
+            return False
+        through.objects.filter(
+            recipe=instance, tag_id__in=current - new
+        ).delete()
+        through.objects.bulk_create([
+            through(recipe=instance, tag_id=pk) for pk in new - current
+        ])
+        return True
+
+    def update_ingredients(self, instance, ingredients):
+        """Inserts, updates and deletes only the amounts that differ.
+
+        Each submitted ingredient gets its row's position in id order as
+        `order`, which is the order refresh_ingredient_names uses.
+        """
+        current = {
+            amount.ingredient_id: amount
+            for amount in sorted(
+                instance.ingredient_in_recipe.all(),
+                key=lambda amount: amount.pk
+            )
+        }
+        positions = {pk: index for index, pk in enumerate(current)}
+        submitted = {
+            ingredient['id']: ingredient for ingredient in ingredients
+        }
+        removed = [
+            amount.pk for pk, amount in current.items()
+            if pk not in submitted
+        ]
+        added = []
+        changed = []
+        for pk, ingredient in submitted.items():
+            amount = current.get(pk)
+            if amount is None:
+                added.append(IngredientAmount(
+                    recipe=instance,
+                    ingredient_id=pk,
+                    amount=ingredient['amount'],
+                ))
+                ingredient['order'] = len(current) + len(added)
+                continue
+            ingredient['order'] = positions[pk]
+            if amount.amount != ingredient['amount']:
+                amount.amount = ingredient['amount']
+                changed.append(amount)
+        if not (removed or added or changed):
+            return False
+        IngredientAmount.objects.write(
+            [instance.pk], delete=removed, create=added, update=changed
+        )
+        return True
 
     def to_representation(self, instance):
         value_data = super().to_representation(instance)
         value_data['ingredients'] = IngredienInRecipeReadSerializer(
-            instance.ingredient_in_recipe.all(), many=True
+            instance.ingredient_in_recipe.select_related('ingredient'),
+            many=True
         ).data
         return value_data
 
@@ -184,39 +304,99 @@ class RecipeCreateSerializer(СommonRecipeSerializer):
             raise serializers.ValidationError(
                 'Необходимо указать Ингридиент(ы).'
             )
-        list_value = []
+        ids = [ingredient['id'] for ingredient in value]
+        if len(set(ids)) != len(ids):
+            raise serializers.ValidationError(
+                'Ингридиенты не должны повторяться'
+            )
+        names = dict(
+            Ingredient.objects.filter(id__in=ids).values_list('id', 'name')
+        )
+        if len(names) != len(ids):
+            raise serializers.ValidationError(
+                'Выберите существующие ингридиенты'
+            )
         for ingredient in value:
-            if not Ingredient.objects.filter(id=ingredient['id']).exists():
-                raise serializers.ValidationError(
-                    'Выберите существующие ингридиенты'
-                )
-            if ingredient in list_value:
-                raise serializers.ValidationError(
-                    'Ингридиенты не должны повторяться'
-                )
-            list_value.append(ingredient)
+            ingredient['name'] = names[ingredient['id']]
         return value
 
 
 class RecipeReadSerializer(СommonRecipeSerializer):
     image = serializers.SerializerMethodField('get_image_url')
+    images = ImageVariantsField()
     ingredients = IngredienInRecipeReadSerializer(
         source='ingredient_in_recipe',
         many=True
     )
 
+    class Meta(СommonRecipeSerializer.Meta):
+        fields = СommonRecipeSerializer.Meta.fields + ('images',)
+
     def get_image_url(self, obj):
         if obj.image:
             return obj.image.url
         return None
 
 
+class PantryRecipeSerializer(RecipeReadSerializer):
+    """A recipe with the share of its ingredients held and the rest.
+
+    Expects the held ingredient ids as `pantry` in the context.
+    """
+    coverage = serializers.SerializerMethodField()
+    missing_ingredients = serializers.SerializerMethodField()
+
+    class Meta(RecipeReadSerializer.Meta):
+        fields = RecipeReadSerializer.Meta.fields + (
+            'coverage', 'missing_ingredients'
+        )
+
+    def get_missing(self, obj):
+        return [
+            amount for amount in obj.ingredient_in_recipe.all()
+            if amount.ingredient_id not in self.context['pantry']
+        ]
+
+    def get_coverage(self, obj):
+        total = len(obj.ingredient_in_recipe.all())
+        if not total:
+            return 0
+        return round(1 - len(self.get_missing(obj)) / total, 4)
+
+    def get_missing_ingredients(self, obj):
+        return IngredienInRecipeReadSerializer(
+            self.get_missing(obj), many=True
+        ).data
+
+
+class PantrySerializer(serializers.Serializer):
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=PANTRY_SIZE,
+    )
+    tags = serializers.SlugRelatedField(
+        slug_field='slug',
+        queryset=Tag.objects.all(),
+        many=True,
+        required=False,
+    )
+    tags_all = serializers.SlugRelatedField(
+        slug_field='slug',
+        queryset=Tag.objects.all(),
+        many=True,
+        required=False,
+    )
+    cooking_time = serializers.IntegerField(min_value=1, required=False)
+
+
 class FavoriteShoppingCartSerializer(serializers.ModelSerializer):
     id = serializers.ReadOnlyField(source='recipe.id',)
     name = serializers.ReadOnlyField(source='recipe.name',)
     image = serializers.SerializerMethodField(
         'get_image_url', source='recipe.image'
     )
+    images = ImageVariantsField(source='recipe')
     cooking_time = serializers.ReadOnlyField(source='recipe.cooking_time',)
 
     def get_image_url(self, obj):
@@ -233,6 +413,7 @@ class FavoriteSerializer(FavoriteShoppingCartSerializer):
             'id',
             'name',
             'image',
+            'images',
             'cooking_time',
         )
 
@@ -245,5 +426,17 @@ class ShoppingCartSerializer(FavoriteShoppingCartSerializer):
             'id',
             'name',
             'image',
+            'images',
             'cooking_time',
         )
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=BATCH_SIZE,
+    )
+
+    def validate_ids(self, value):
+        return list(dict.fromkeys(value))
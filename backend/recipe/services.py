@@ -0,0 +1,147 @@
+from django.db import connections, transaction
+from django.db.models import Exists, OuterRef
+
+from api.cache import bump_generation_on_commit
+from recipe import shopping_list
+from recipe.counters import count_row, recount_rows
+from recipe.models import Recipe, ShoppingCart
+
+ADDED = 'added'
+EXISTS = 'exists'
+REMOVED = 'removed'
+ABSENT = 'absent'
+NOT_FOUND = 'not_found'
+
+
+def recipe_links(model, user, recipe_ids):
+    """{recipe id: whether `user` already has it} for existing recipes."""
+    return dict(Recipe.objects.filter(pk__in=recipe_ids).annotate(
+        linked=Exists(model.objects.filter(user=user, recipe=OuterRef('pk')))
+    ).values_list('pk', 'linked'))
+
+
+def relations_changed(model, user, recipe_ids):
+    """What the post_save/post_delete receivers do, once for all rows."""
+    recount_rows(model, {'recipe': recipe_ids, 'user': [user.pk]})
+    if model is ShoppingCart:
+        shopping_list.recount_items(user.pk, recipe_ids)
+    bump_generation_on_commit(f'user:{user.pk}')
+
+
+def row_changed(instance, delta):
+    """What the receivers do for one inserted (1) or deleted (-1) row."""
+    count_row(instance, delta)
+    if isinstance(instance, ShoppingCart):
+        shopping_list.cart_changed(
+            instance.user_id, [instance.recipe_id], delta
+        )
+    bump_generation_on_commit(f'user:{instance.user_id}')
+
+
+def add_recipes(model, user, recipe_ids):
+    """Adds recipes to a favorite/cart-like list with a single INSERT.
+
+    Returns {recipe id: status}. Rows are bulk created, so the counters
+    and caches are updated here instead of in the signal receivers.
+    """
+    links = recipe_links(model, user, recipe_ids)
+    new = [pk for pk in recipe_ids if links.get(pk) is False]
+    if new:
+        with transaction.atomic():
+            model.objects.bulk_create(
+                [model(user=user, recipe_id=pk) for pk in new],
+                ignore_conflicts=True,
+            )
+            relations_changed(model, user, new)
+    return {
+        pk: NOT_FOUND if pk not in links else EXISTS if links[pk] else ADDED
+        for pk in recipe_ids
+    }
+
+
+def remove_recipes(model, user, recipe_ids):
+    """Removes recipes from a favorite/cart-like list with one DELETE."""
+    links = recipe_links(model, user, recipe_ids)
+    linked = [pk for pk in recipe_ids if links.get(pk)]
+    if linked:
+        with transaction.atomic():
+            removed = delete_rows(
+                model.objects.filter(user=user, recipe_id__in=linked),
+                'recipe',
+            )
+            if removed:
+                relations_changed(model, user, removed)
+    return {
+        pk: NOT_FOUND if pk not in links else REMOVED if links[pk]
+        else ABSENT
+        for pk in recipe_ids
+    }
+
+
+def delete_rows(rows, field=None):
+    """Deletes `rows` with one DELETE ... RETURNING and returns the value
+    of `field` (the pk by default) of each deleted row.
+
+    QuerySet.delete() would load the rows and send post_delete for each
+    of them, so callers update counters and caches themselves.
+    """
+    meta = rows.model._meta
+    returned = meta.get_field(field) if field else meta.pk
+    sql, params = rows.values('pk').query.sql_with_params()
+    with connections[rows.db].cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {meta.db_table} '
+            f'WHERE {meta.pk.column} IN ({sql}) '
+            f'RETURNING {returned.column}',
+            params,
+        )
+        return [value for value, in cursor.fetchall()]
+
+
+def link(instance):
+    """Inserts an unsaved relation row unless it already exists.
+
+    One INSERT ... ON CONFLICT DO NOTHING, so concurrent duplicates are
+    told apart by the row count instead of an IntegrityError. Returns
+    whether the row was added; what the post_save receivers would do
+    happens in the same transaction.
+    """
+    meta = instance._meta
+    fields = [
+        field for field in meta.concrete_fields if not field.primary_key
+    ]
+    connection = connections[instance._state.db or 'default']
+    with transaction.atomic(connection.alias):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO {} ({}) VALUES ({}) '
+                'ON CONFLICT DO NOTHING'.format(
+                    meta.db_table,
+                    ', '.join(field.column for field in fields),
+                    ', '.join(['%s'] * len(fields)),
+                ),
+                [
+                    field.get_db_prep_save(
+                        getattr(instance, field.attname), connection
+                    )
+                    for field in fields
+                ],
+            )
+            added = cursor.rowcount > 0
+        if added:
+            row_changed(instance, 1)
+    return added
+
+
+def unlink(instance):
+    """Deletes the stored copy of a relation row with one DELETE."""
+    meta = instance._meta
+    rows = instance.__class__.objects.filter(**{
+        field.attname: getattr(instance, field.attname)
+        for field in meta.concrete_fields if not field.primary_key
+    })
+    with transaction.atomic(rows.db):
+        removed = bool(delete_rows(rows))
+        if removed:
+            row_changed(instance, -1)
+    return removed
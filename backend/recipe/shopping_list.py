@@ -0,0 +1,250 @@
+import csv
+import hashlib
+import io
+import json
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F, IntegerField, Sum, Value
+from django.http import StreamingHttpResponse
+from django.utils.http import quote_etag
+
+from api.cache import get_generation
+from recipe.models import IngredientAmount, ShoppingCart, ShoppingListItem
+from recipe.pdf import PdfDocument, load_font
+
+TITLE = 'Список покупок'
+FILENAME = 'Shopping-list'
+CHUNK_SIZE = 64 * 1024
+ITERATOR_CHUNK_SIZE = 2000
+
+
+def cart_amounts(**filters):
+    """Ingredient amounts of carted recipes, one row per cart they are in.
+    """
+    return IngredientAmount.objects.annotate(
+        cart_user=F('recipe__shopping_cart__user_id')
+    ).filter(cart_user__isnull=False, **filters)
+
+
+def recipe_amounts(user_id, recipe_ids):
+    return IngredientAmount.objects.filter(
+        recipe_id__in=recipe_ids
+    ).annotate(cart_user=Value(user_id, output_field=IntegerField()))
+
+
+def summed(amounts, sign=1):
+    return amounts.values('cart_user', 'ingredient_id').annotate(
+        total_amount=Sum('amount') * sign,
+        recipe_count=Count('recipe_id', distinct=True) * sign,
+    ).order_by()
+
+
+def add_items(rows):
+    """Adds `summed` rows to the stored items in one INSERT ... SELECT."""
+    sql, params = rows.query.sql_with_params()
+    table = ShoppingListItem._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} '
+            '(user_id, ingredient_id, total_amount, recipe_count) '
+            'SELECT cart_user, ingredient_id, total_amount, recipe_count '
+            f'FROM ({sql}) changes WHERE true '
+            'ON CONFLICT (user_id, ingredient_id) DO UPDATE SET '
+            f'total_amount = {table}.total_amount + excluded.total_amount, '
+            f'recipe_count = {table}.recipe_count + excluded.recipe_count',
+            params,
+        )
+
+
+def cart_changed(user_id, recipe_ids, sign):
+    """Adds (sign 1) or takes away (-1) the amounts of `recipe_ids` after
+    they were put into or taken out of the user's cart.
+    """
+    add_items(summed(recipe_amounts(user_id, recipe_ids), sign))
+    if sign < 0:
+        ShoppingListItem.objects.filter(
+            user_id=user_id, recipe_count__lte=0
+        ).delete()
+
+
+def recount_items(user_id, recipe_ids):
+    """Recomputes the user's items for the ingredients of `recipe_ids`.
+
+    For batch changes, where the cart rows actually inserted or deleted
+    are not known.
+    """
+    ingredients = IngredientAmount.objects.filter(
+        recipe_id__in=recipe_ids
+    ).values('ingredient_id')
+    ShoppingListItem.objects.filter(
+        user_id=user_id, ingredient_id__in=ingredients
+    ).delete()
+    add_items(summed(
+        cart_amounts(cart_user=user_id, ingredient_id__in=ingredients)
+    ))
+
+
+@contextmanager
+def recipes_changing(recipe_ids):
+    """Moves the amounts of `recipe_ids` in every cart from before the
+    block to after it, for edits of their ingredient amounts.
+    """
+    with transaction.atomic():
+        add_items(summed(cart_amounts(recipe_id__in=recipe_ids), -1))
+        yield
+        add_items(summed(cart_amounts(recipe_id__in=recipe_ids)))
+        drop_empty_items(recipe_ids)
+
+
+def amount_changed(amount_id, sign, recipe_ids):
+    """Takes one saved amount out of every cart before a save (sign -1)
+    and puts it back after it (1); `recipe_ids` are its old and new
+    recipes.
+    """
+    add_items(summed(cart_amounts(pk=amount_id), sign))
+    if sign > 0:
+        drop_empty_items(recipe_ids)
+
+
+def drop_empty_items(recipe_ids):
+    ShoppingListItem.objects.filter(
+        recipe_count__lte=0,
+        user_id__in=ShoppingCart.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values('user_id'),
+    ).delete()
+
+
+def rebuild_items():
+    with transaction.atomic():
+        ShoppingListItem.objects.all().delete()
+        add_items(summed(cart_amounts()))
+    return ShoppingListItem.objects.count()
+
+
+def stale_items():
+    """(user, ingredient) pairs whose stored item differs from the carts.
+    """
+    stored = {
+        (user_id, ingredient_id): (total_amount, recipe_count)
+        for user_id, ingredient_id, total_amount, recipe_count in
+        ShoppingListItem.objects.values_list(
+            'user_id', 'ingredient_id', 'total_amount', 'recipe_count'
+        ).iterator(ITERATOR_CHUNK_SIZE)
+    }
+    stale = []
+    for user_id, ingredient_id, total_amount, recipe_count in summed(
+        cart_amounts()
+    ).values_list(
+        'cart_user', 'ingredient_id', 'total_amount', 'recipe_count'
+    ).iterator(ITERATOR_CHUNK_SIZE):
+        key = (user_id, ingredient_id)
+        if stored.pop(key, None) != (total_amount, recipe_count):
+            stale.append(key)
+    return stale + list(stored)
+
+
+def get_rows(user):
+    return ShoppingListItem.objects.filter(user=user).values(
+        'ingredient__name',
+        'ingredient__measurement_unit',
+        amount=F('total_amount'),
+    ).order_by(
+        'ingredient__name', 'ingredient__measurement_unit'
+    ).iterator(chunk_size=ITERATOR_CHUNK_SIZE)
+
+
+def get_etag(user, export_format):
+    digest = hashlib.sha256(
+        f'{export_format}:{get_generation("ingredients")}'.encode()
+    )
+    carted = ShoppingCart.objects.filter(user=user).order_by(
+        'recipe_id'
+    ).values_list('recipe_id', 'recipe__updated_at')
+    for recipe_id, updated_at in carted.iterator(ITERATOR_CHUNK_SIZE):
+        digest.update(f'{recipe_id}:{updated_at.isoformat()};'.encode())
+    return quote_etag(digest.hexdigest()[:32])
+
+
+def buffered(chunks, size=CHUNK_SIZE):
+    buffer = []
+    length = 0
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        buffer.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield b''.join(buffer)
+            buffer = []
+            length = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def render_line(row):
+    return '{} {} {}'.format(
+        row['ingredient__name'],
+        row['amount'],
+        row['ingredient__measurement_unit'],
+    )
+
+
+def write_txt(rows):
+    yield f'{TITLE}\n'
+    for row in rows:
+        yield render_line(row) + '\n'
+
+
+def write_csv(rows):
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(('name', 'amount', 'measurement_unit'))
+    for row in rows:
+        writer.writerow((
+            row['ingredient__name'],
+            row['amount'],
+            row['ingredient__measurement_unit'],
+        ))
+        yield output.getvalue()
+        output.seek(0)
+        output.truncate()
+    yield output.getvalue()
+
+
+def write_json(rows):
+    separator = '['
+    for row in rows:
+        yield separator + json.dumps({
+            'name': row['ingredient__name'],
+            'amount': row['amount'],
+            'measurement_unit': row['ingredient__measurement_unit'],
+        }, ensure_ascii=False)
+        separator = ',\n'
+    yield ']\n' if separator != '[' else '[]\n'
+
+
+def write_pdf(rows):
+    document = PdfDocument(load_font(settings.SHOPPING_LIST_FONT))
+    return document.render(TITLE, (render_line(row) for row in rows))
+
+
+FORMATS = {
+    'txt': ('text/plain; charset=utf-8', write_txt),
+    'csv': ('text/csv; charset=utf-8', write_csv),
+    'json': ('application/json', write_json),
+    'pdf': ('application/pdf', write_pdf),
+}
+
+
+def export(user, export_format):
+    content_type, writer = FORMATS[export_format]
+    response = StreamingHttpResponse(
+        buffered(writer(get_rows(user))), content_type=content_type
+    )
+    response['Content-Disposition'] = (
+        f'attachment; filename="{FILENAME}.{export_format}"'
+    )
+    return response
@@ -0,0 +1,78 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+from recipe.models import Recipe
+
+CACHE_KEY = 'short-link:{}'
+MISSING = 0
+
+
+class LRUCache:
+    """A small thread-safe mapping that forgets the least recently used.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.data:
+                return None
+            self.data.move_to_end(key)
+            return self.data[key]
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.size:
+                self.data.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+
+_resolved = LRUCache(settings.SHORT_LINK_LRU_SIZE)
+
+
+def resolve(code):
+    """Recipe id of a short code, or None.
+
+    Codes never change, so they are looked up in this process first,
+    then in the shared cache, and only then in the database. Unknown
+    codes are remembered in the shared cache for a short while only.
+    """
+    pk = _resolved.get(code)
+    if pk is not None:
+        return pk
+    key = CACHE_KEY.format(code)
+    pk = cache.get(key)
+    if pk is None:
+        pk = Recipe.objects.filter(short_code=code).values_list(
+            'pk', flat=True
+        ).first()
+        if pk is None:
+            cache.set(key, MISSING, settings.SHORT_LINK_MISSING_TIMEOUT)
+            return None
+        remember(code, pk)
+        return pk
+    if pk == MISSING:
+        return None
+    _resolved.set(code, pk)
+    return pk
+
+
+def remember(code, pk):
+    _resolved.set(code, pk)
+    cache.set(CACHE_KEY.format(code), pk, None)
+
+
+def forget(code):
+    _resolved.delete(code)
+    cache.delete(CACHE_KEY.format(code))
@@ -0,0 +1,259 @@
+from django.db import transaction
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save,
+)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from api.cache import bump_generation, bump_generation_on_commit
+from recipe import (
+    feed,
+    images,
+    ingredient_index,
+    search,
+    shopping_list,
+    short_links,
+    similar,
+)
+from recipe.counters import count_row
+from recipe.models import (
+    Favorite,
+    Follow,
+    Ingredient,
+    IngredientAmount,
+    Recipe,
+    ShoppingCart,
+    Tag,
+    User,
+)
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def ingredient_changed(sender, **kwargs):
+    def bump():
+        bump_generation('ingredients')
+        ingredient_index.invalidate()
+    transaction.on_commit(bump)
+
+
+@receiver(pre_save, sender=Ingredient)
+def ingredient_renaming(sender, instance, **kwargs):
+    instance._saved_name = Ingredient.objects.filter(
+        pk=instance.pk
+    ).values_list('name', flat=True).first() if instance.pk else None
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_saved(sender, instance, created, **kwargs):
+    saved_name = getattr(instance, '_saved_name', None)
+    if saved_name is not None and saved_name != instance.name:
+        search.refresh_ingredient.delay(instance.pk)
+
+
+@receiver(pre_delete, sender=Ingredient)
+def ingredient_deleted(sender, instance, **kwargs):
+    pks = list(instance.ingredient_in_recipe.values_list(
+        'recipe_id', flat=True
+    ).distinct())
+    if pks:
+        search.refresh_recipes.delay(pks)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_indexed(sender, instance, using, update_fields=None, **kwargs):
+    if update_fields and not set(update_fields) & search.INDEXED_FIELDS:
+        return
+    search.index_recipes([instance], using)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_unindexed(sender, instance, using, **kwargs):
+    search.unindex_recipes([instance.pk], using)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_short_link_deleted(sender, instance, **kwargs):
+    transaction.on_commit(lambda: short_links.forget(instance.short_code))
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_published(sender, instance, created, **kwargs):
+    if created and instance.author.followers_count and feed.is_fanned_out(
+        instance.author.followers_count
+    ):
+        feed.fan_out.delay(instance.pk)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_neighbors_changed(sender, instance, update_fields=None,
+                             **kwargs):
+    if update_fields and not set(update_fields) & {
+        'tags_mask', 'ingredient_names'
+    }:
+        return
+    similar.update_recipe.delay(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+def recipe_changed(sender, instance, **kwargs):
+    bump_generation_on_commit('recipes', f'recipe:{instance.pk}')
+
+
+def recipes_changed(pks, tags=False):
+    recipes = Recipe.objects.filter(pk__in=pks)
+    if tags:
+        recipes.update_tags_mask(updated_at=timezone.now())
+    else:
+        recipes.update(updated_at=timezone.now())
+    bump_generation_on_commit('recipes', *(f'recipe:{pk}' for pk in pks))
+
+
+def amounts_changed(pks):
+    search.refresh_ingredient_names(pks)
+    recipes_changed(pks)
+    for pk in pks:
+        similar.update_recipe.delay(pk)
+
+
+@receiver(pre_save, sender=IngredientAmount)
+def recipe_ingredient_saving(sender, instance, **kwargs):
+    instance._saved_recipe_id = None
+    if instance.pk is None:
+        return
+    instance._saved_recipe_id = IngredientAmount.objects.filter(
+        pk=instance.pk
+    ).values_list('recipe_id', flat=True).first()
+    shopping_list.amount_changed(
+        instance.pk, -1, [instance._saved_recipe_id]
+    )
+
+
+@receiver(post_save, sender=IngredientAmount)
+def recipe_ingredient_changed(sender, instance, **kwargs):
+    # Bulk writes go through IngredientAmount.objects.write().
+    pks = {instance.recipe_id, getattr(instance, '_saved_recipe_id', None)}
+    pks.discard(None)
+    shopping_list.amount_changed(instance.pk, 1, pks)
+    amounts_changed(pks)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(sender, instance, action, pk_set, **kwargs):
+    if action == 'pre_clear' and isinstance(instance, Tag):
+        instance._cleared_recipes = list(
+            instance.recipes.values_list('pk', flat=True)
+        )
+    if not action.startswith('post_'):
+        return
+    if isinstance(instance, Recipe):
+        pk_set = {instance.pk}
+    elif action == 'post_clear':
+        pk_set = getattr(instance, '_cleared_recipes', ())
+    recipes_changed(pk_set or (), tags=True)
+
+
+@receiver(pre_delete, sender=Tag)
+def tag_deleting(sender, instance, **kwargs):
+    instance._tagged_recipes = list(
+        instance.recipes.values_list('pk', flat=True)
+    )
+
+
+@receiver(post_delete, sender=Tag)
+def tag_deleted(sender, instance, **kwargs):
+    recipes_changed(getattr(instance, '_tagged_recipes', ()), tags=True)
+
+
+@receiver([post_save, post_delete], sender=Tag)
+def tag_changed(sender, **kwargs):
+    bump_generation_on_commit('tags')
+
+
+@receiver([post_save, post_delete], sender=Favorite)
+@receiver([post_save, post_delete], sender=ShoppingCart)
+@receiver([post_save, post_delete], sender=Follow)
+def user_relation_changed(sender, instance, **kwargs):
+    bump_generation_on_commit(f'user:{instance.user_id}')
+
+
+@receiver([post_save, post_delete], sender=User)
+def user_changed(sender, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    bump_generation_on_commit('authors')
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_image_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields and 'image' not in update_fields:
+        return
+    images.schedule_update(
+        instance, 'image', ['recipes', f'recipe:{instance.pk}']
+    )
+
+
+@receiver(post_save, sender=User)
+def user_avatar_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields and 'avatar' not in update_fields:
+        return
+    images.schedule_update(instance, 'avatar', ['authors'])
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_image_deleted(sender, instance, **kwargs):
+    images.schedule_delete(instance, 'image')
+
+
+@receiver(post_delete, sender=User)
+def user_avatar_deleted(sender, instance, **kwargs):
+    images.schedule_delete(instance, 'avatar')
+
+
+@receiver(pre_save, sender=ShoppingCart)
+def cart_row_saving(sender, instance, **kwargs):
+    if instance.pk is None:
+        return
+    saved = ShoppingCart.objects.filter(pk=instance.pk).values_list(
+        'user_id', 'recipe_id'
+    ).first()
+    if saved is not None:
+        shopping_list.cart_changed(saved[0], [saved[1]], -1)
+
+
+@receiver(post_save, sender=ShoppingCart)
+def cart_row_saved(sender, instance, **kwargs):
+    shopping_list.cart_changed(instance.user_id, [instance.recipe_id], 1)
+
+
+@receiver(pre_delete, sender=ShoppingCart)
+def cart_row_deleting(sender, instance, **kwargs):
+    # Before the delete: a cascade from Recipe removes the ingredient
+    # amounts first.
+    shopping_list.cart_changed(instance.user_id, [instance.recipe_id], -1)
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Follow)
+def counted_row_saved(sender, instance, created, **kwargs):
+    if created:
+        count_row(instance, 1)
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingCart)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Follow)
+def counted_row_deleted(sender, instance, **kwargs):
+    count_row(instance, -1)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    # After counted_row_deleted, so the author's count is already lower.
+    feed.follower_removed(instance.following_id)
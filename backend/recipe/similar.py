@@ -0,0 +1,325 @@
+import heapq
+import math
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Q
+
+from jobs.queue import job
+from recipe.models import IngredientAmount, Recipe, RecipeNeighbor, Tag
+
+
+class Weights:
+    """IDF weights, log(N / df): ingredients found in nearly every recipe
+    (salt, water) add almost nothing to a similarity.
+
+    Only ingredients in at most SIMILAR_MAX_SHARE of the recipes, or in
+    at most SIMILAR_MAX_COUNT_FLOOR of them in a small catalogue, are
+    distinctive enough to make two recipes candidates for each other;
+    the rest still count in the score of a candidate. Weights loaded for
+    some ingredients only pick up the others on `include`.
+    """
+
+    def __init__(self, recipe_count, ingredient_counts, tag_counts,
+                 complete=True):
+        self.recipe_count = recipe_count
+        self.ingredient_counts = ingredient_counts
+        self.tag_counts = tag_counts
+        self.complete = complete
+        self.max_count = max(
+            settings.SIMILAR_MAX_SHARE * recipe_count,
+            settings.SIMILAR_MAX_COUNT_FLOOR,
+        )
+
+    @staticmethod
+    def count_ingredients(ingredient_ids=None):
+        amounts = IngredientAmount.objects.order_by()
+        if ingredient_ids is not None:
+            amounts = amounts.filter(ingredient_id__in=ingredient_ids)
+        return dict(amounts.values('ingredient_id').annotate(
+            count=Count('recipe_id', distinct=True)
+        ).values_list('ingredient_id', 'count'))
+
+    @classmethod
+    def load(cls, ingredient_ids=None):
+        tag_counts = dict(Tag.objects.exclude(bit=None).annotate(
+            count=Count('recipes')
+        ).values_list('bit', 'count'))
+        return cls(
+            Recipe.objects.count(),
+            cls.count_ingredients(ingredient_ids),
+            tag_counts,
+            complete=ingredient_ids is None,
+        )
+
+    def include(self, ingredient_ids):
+        if self.complete:
+            return
+        missing = set(ingredient_ids) - self.ingredient_counts.keys()
+        if missing:
+            self.ingredient_counts.update(dict.fromkeys(missing, 0))
+            self.ingredient_counts.update(self.count_ingredients(missing))
+
+    def idf(self, count):
+        return math.log(self.recipe_count / count) if count else 0.0
+
+    def is_distinctive(self, ingredient_id):
+        count = self.ingredient_counts.get(ingredient_id, 0)
+        return 1 < count <= self.max_count
+
+    def vector(self, ingredient_ids, tags_mask):
+        """(ingredients, tags) weights of a recipe, scaled to unit length,
+        or None if it has nothing that carries weight.
+        """
+        ingredients = {
+            pk: self.idf(self.ingredient_counts.get(pk, 0))
+            for pk in ingredient_ids
+        }
+        tags = {
+            bit: settings.SIMILAR_TAG_WEIGHT * self.idf(count)
+            for bit, count in self.tag_counts.items()
+            if tags_mask >> bit & 1
+        }
+        norm = math.sqrt(
+            sum(weight ** 2 for weight in ingredients.values())
+            + sum(weight ** 2 for weight in tags.values())
+        )
+        if not norm:
+            return None
+        return (
+            {
+                pk: weight / norm
+                for pk, weight in ingredients.items() if weight
+            },
+            {bit: weight / norm for bit, weight in tags.items() if weight},
+        )
+
+
+def dot(first, second):
+    if len(first) > len(second):
+        first, second = second, first
+    return sum(
+        weight * second[key] for key, weight in first.items()
+        if key in second
+    )
+
+
+class Matrix:
+    """Sparse recipe × (ingredient, tag) matrix with unit-length rows.
+
+    Rows are dicts, and the distinctive ingredient columns of the loaded
+    rows are read as posting lists of recipe ids, so the candidates of a
+    row are only the recipes that share such an ingredient with it.
+    """
+
+    def __init__(self, weights):
+        self.weights = weights
+        self.rows = {}
+        self.postings = defaultdict(list)
+
+    def load(self, recipe_ids):
+        """Adds the rows of `recipe_ids` that are not loaded yet."""
+        recipe_ids = set(recipe_ids) - self.rows.keys()
+        if not recipe_ids:
+            return
+        ingredients = defaultdict(list)
+        for recipe_id, ingredient_id in IngredientAmount.objects.filter(
+            recipe_id__in=recipe_ids
+        ).order_by('recipe_id').values_list(
+            'recipe_id', 'ingredient_id'
+        ).iterator():
+            ingredients[recipe_id].append(ingredient_id)
+        self.weights.include(
+            pk for pks in ingredients.values() for pk in pks
+        )
+        for recipe_id, tags_mask in Recipe.objects.filter(
+            pk__in=recipe_ids
+        ).order_by('id').values_list('id', 'tags_mask').iterator():
+            self.add(recipe_id, ingredients.pop(recipe_id, ()), tags_mask)
+
+    def add(self, recipe_id, ingredient_ids, tags_mask):
+        row = self.weights.vector(ingredient_ids, tags_mask)
+        if row is None:
+            return
+        self.rows[recipe_id] = row
+
+    def load_postings(self):
+        """Reads the recipe ids of the distinctive ingredients of the
+        loaded rows without loading those recipes.
+        """
+        ingredient_ids = {
+            pk for ingredients, _ in self.rows.values() for pk in ingredients
+            if self.weights.is_distinctive(pk)
+        } - self.postings.keys()
+        for ingredient_id, recipe_id in IngredientAmount.objects.filter(
+            ingredient_id__in=ingredient_ids
+        ).order_by().values_list(
+            'ingredient_id', 'recipe_id'
+        ).distinct().iterator():
+            self.postings[ingredient_id].append(recipe_id)
+
+    def candidates(self, recipe_id, limit):
+        """The `limit` recipes whose shared distinctive ingredients weigh
+        the most in the row of `recipe_id`.
+        """
+        overlap = defaultdict(float)
+        for pk, weight in self.rows[recipe_id][0].items():
+            for other in self.postings.get(pk, ()):
+                overlap[other] += weight
+        overlap.pop(recipe_id, None)
+        return set(heapq.nlargest(limit, overlap, key=overlap.get))
+
+    def scores(self, recipe_id, candidates):
+        """Cosine similarity of `recipe_id` to each loaded candidate."""
+        ingredients, tags = self.rows[recipe_id]
+        scores = {}
+        for other in candidates:
+            if other not in self.rows:
+                continue
+            other_ingredients, other_tags = self.rows[other]
+            score = dot(ingredients, other_ingredients) + dot(tags, other_tags)
+            if score > 0:
+                scores[other] = score
+        return scores
+
+
+def fallback_candidates(recipe_id, row, limit):
+    """Recipes sharing most of the ingredients of a recipe whose
+    distinctive ones found too few candidates, then recipes sharing its
+    tags.
+    """
+    ingredients, tags = row
+    found = list(IngredientAmount.objects.filter(
+        ingredient_id__in=list(ingredients)
+    ).exclude(recipe_id=recipe_id).values('recipe_id').annotate(
+        shared=Count('ingredient_id')
+    ).order_by('-shared', '-recipe_id').values_list(
+        'recipe_id', flat=True
+    )[:limit])
+    tags_mask = sum(1 << bit for bit in tags)
+    if len(found) < limit and tags_mask:
+        found += Recipe.objects.alias(
+            matched_tags=F('tags_mask').bitand(tags_mask)
+        ).exclude(matched_tags=0).exclude(
+            pk__in=[recipe_id, *found]
+        ).order_by('-pub_date', '-id').values_list(
+            'id', flat=True
+        )[:limit - len(found)]
+    return found
+
+
+def score_candidates(weights, recipe_ids, count):
+    """{recipe id: {candidate id: score}} for each of `recipe_ids`.
+
+    Only these recipes and their candidates are loaded: up to
+    SIMILAR_MAX_CANDIDATES recipes sharing the most distinctive
+    ingredient weight with each of them, plus fallback candidates for
+    the recipes that have fewer than `count` of those.
+    """
+    matrix = Matrix(weights)
+    matrix.load(recipe_ids)
+    matrix.load_postings()
+    candidates = {}
+    for pk in recipe_ids:
+        if pk not in matrix.rows:
+            continue
+        candidates[pk] = matrix.candidates(
+            pk, settings.SIMILAR_MAX_CANDIDATES
+        )
+        if len(candidates[pk]) < count:
+            candidates[pk].update(fallback_candidates(
+                pk, matrix.rows[pk], settings.SIMILAR_FALLBACK_CANDIDATES
+            ))
+    matrix.load(set().union(*candidates.values()))
+    return {
+        pk: matrix.scores(pk, found) for pk, found in candidates.items()
+    }
+
+
+def top(scores, count):
+    return heapq.nlargest(
+        count, ((score, other) for other, score in scores.items())
+    )
+
+
+def build(count=None, chunk_size=None):
+    """Recomputes every neighbour list and returns the number of rows.
+
+    Recipes are taken a chunk at a time: only a chunk and its candidates
+    are loaded, and each chunk replaces its old rows in one transaction.
+    """
+    count = count or settings.SIMILAR_RECIPES_COUNT
+    chunk_size = chunk_size or settings.SIMILAR_CHUNK_SIZE
+    weights = Weights.load()
+    recipe_ids = list(
+        Recipe.objects.order_by('id').values_list('id', flat=True)
+    )
+    total = 0
+    for start in range(0, len(recipe_ids), chunk_size):
+        chunk = recipe_ids[start:start + chunk_size]
+        rows = [
+            RecipeNeighbor(recipe_id=pk, neighbor_id=other, score=score)
+            for pk, scores in score_candidates(weights, chunk, count).items()
+            for score, other in top(scores, count)
+        ]
+        with transaction.atomic():
+            # Skip recipes deleted since the chunk was loaded.
+            existing = set(Recipe.objects.filter(
+                pk__in={row.neighbor_id for row in rows} | set(chunk)
+            ).values_list('pk', flat=True))
+            rows = [
+                row for row in rows
+                if row.recipe_id in existing and row.neighbor_id in existing
+            ]
+            RecipeNeighbor.objects.filter(recipe_id__in=chunk).delete()
+            RecipeNeighbor.objects.bulk_create(rows, ignore_conflicts=True)
+        total += len(rows)
+    return total
+
+
+@job
+def update_recipe(recipe_id):
+    """Recomputes the neighbours of a new or edited recipe and puts it
+    into the lists of the recipes it is now close to.
+
+    A recipe that has moved away from some other recipe only leaves that
+    recipe's list, which is refilled by the next `build`.
+    """
+    count = settings.SIMILAR_RECIPES_COUNT
+    scores = score_candidates(
+        Weights.load(()), [recipe_id], count
+    ).get(recipe_id, {})
+    rows = [
+        RecipeNeighbor(recipe_id=recipe_id, neighbor_id=other, score=score)
+        for score, other in top(scores, count)
+    ]
+    lists = defaultdict(list)
+    for pk, other, score in RecipeNeighbor.objects.filter(
+        recipe_id__in=scores
+    ).exclude(neighbor_id=recipe_id).values_list('id', 'recipe_id', 'score'):
+        lists[other].append((score, pk))
+    evicted = []
+    for other, score in scores.items():
+        if len(lists[other]) >= count:
+            lowest = min(lists[other])
+            if score <= lowest[0]:
+                continue
+            evicted.append(lowest[1])
+        rows.append(
+            RecipeNeighbor(recipe_id=other, neighbor_id=recipe_id, score=score)
+        )
+    with transaction.atomic():
+        RecipeNeighbor.objects.filter(
+            Q(recipe_id=recipe_id) | Q(neighbor_id=recipe_id)
+            | Q(pk__in=evicted)
+        ).delete()
+        RecipeNeighbor.objects.bulk_create(rows, ignore_conflicts=True)
+
+
+def similar_recipe_ids(recipe_id, limit):
+    return list(RecipeNeighbor.objects.filter(
+        recipe_id=recipe_id
+    ).order_by('-score', 'neighbor_id').values_list(
+        'neighbor_id', flat=True
+    )[:limit])
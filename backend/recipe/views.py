@@ -1,7 +1,9 @@
-from django.db.models import Sum
-from django.http import FileResponse
+from django.conf import settings
 from django.shortcuts import get_object_or_404
+from django.http import Http404, HttpResponseRedirect
 from django.http.response import JsonResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import status, viewsets
 from rest_framework.mixins import (
@@ -9,29 +11,66 @@ from rest_framework.mixins import (
     RetrieveModelMixin
 )
 from rest_framework.permissions import IsAuthenticated, AllowAny
-from rest_framework.pagination import LimitOffsetPagination
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.parsers import FormParser, JSONParser, MultiPartParser
 from recipe.models import (
     Tag,
     Ingredient,
     Recipe,
     Favorite,
     ShoppingCart,
-    IngredientAmount
 )
-from api.filters import RecipeFilter, IngredientFilter
+from api.cache import CachedResponseMixin, ConditionalGetMixin
+from api.filters import RecipeFilter
+from api.negotiation import FileDownloadNegotiation
+from api.pagination import (
+    FeedPagination,
+    PantryPagination,
+    RecipePagination,
+)
 from api.permissions import IsAuthorOrReadOnlyPermission
+from recipe import (
+    feed,
+    pantry,
+    services,
+    shopping_list,
+    short_links,
+    similar,
+)
+from recipe.ingredient_index import get_index
 from recipe.serializers import (
     TagSerializer,
     IngredientSerializer,
     RecipeReadSerializer,
     RecipeCreateSerializer,
     FavoriteSerializer,
+    PantryRecipeSerializer,
+    PantrySerializer,
+    RecipeIdsSerializer,
     ShoppingCartSerializer,
 )
 
 
+def get_limit(request, default=None):
+    limit = request.query_params.get('limit')
+    if limit is None:
+        return default
+    if not limit.isdigit() or int(limit) < 1:
+        raise ValidationError(
+            {'limit': 'Должно быть положительным целым числом'}
+        )
+    return int(limit)
+
+
+class PantryIndexNotReady(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Поиск по продуктам ещё готовится, повторите позже.'
+    default_code = 'pantry_index_not_ready'
+    wait = 5
+
+
 class ListRetrieveViewSet(
     ListModelMixin,
     RetrieveModelMixin,
@@ -41,26 +80,70 @@ class ListRetrieveViewSet(
     pagination_class = None
 
 
-class TagViewSet(ListRetrieveViewSet):
+class TagViewSet(
+    ConditionalGetMixin, CachedResponseMixin, ListRetrieveViewSet
+):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
+    cache_scopes = ('tags',)
 
 
-class IngredientViewSet(ListRetrieveViewSet):
+class IngredientViewSet(
+    ConditionalGetMixin, CachedResponseMixin, ListRetrieveViewSet
+):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
-    filter_backends = (DjangoFilterBackend,)
-    filterset_class = IngredientFilter
+    cache_scopes = ('ingredients',)
+
+    def list(self, request, *args, **kwargs):
+        return self.get_conditional_response(self.search, request)
 
+    def search(self, request):
+        return Response(get_index().search(
+            request.query_params.get('name', ''), get_limit(request)
+        ))
 
-class RecipeViewSet(viewsets.ModelViewSet):
+
+class RecipeViewSet(
+    ConditionalGetMixin, CachedResponseMixin, viewsets.ModelViewSet
+):
     queryset = Recipe.objects.all()
     serializer_class = RecipeCreateSerializer
     http_method_names = ['get', 'post', 'patch', 'delete']
     permission_classes = [IsAuthorOrReadOnlyPermission]
-    pagination_class = LimitOffsetPagination
+    parser_classes = (JSONParser, MultiPartParser, FormParser)
+    pagination_class = RecipePagination
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
+    cache_params = (
+        'tags',
+        'tags_all',
+        'author',
+        'is_favorited',
+        'is_in_shopping_cart',
+        'limit',
+        'offset',
+        'cursor',
+        'count',
+        'search',
+    )
+
+    def get_cache_scopes(self):
+        scopes = ['authors', 'tags', 'ingredients']
+        if self.action == 'retrieve':
+            return [f'recipe:{self.kwargs["pk"]}', *scopes]
+        return ['recipes', *scopes]
+
+    def get_validator_data(self, request):
+        if self.action != 'retrieve':
+            return None, None
+        updated_at = Recipe.objects.filter(
+            pk=self.kwargs['pk']
+        ).values_list('updated_at', flat=True).first()
+        return updated_at, updated_at
+
+    def get_queryset(self):
+        return Recipe.objects.with_related(self.request.user)
 
     def get_serializer_class(self):
         if self.action in ['create', 'update', 'partial_update']:
@@ -70,18 +153,92 @@ class RecipeViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
+    @action(methods=['get'],
+            url_path='feed',
+            url_name='feed',
+            permission_classes=[IsAuthenticated],
+            pagination_class=FeedPagination,
+            detail=False)
+    def feed(self, request):
+        queryset = self.filter_queryset(
+            feed.feed_recipes(request.user).with_related(request.user)
+        )
+        page = self.paginate_queryset(queryset)
+        serializer = RecipeReadSerializer(
+            page, many=True, context=self.get_serializer_context()
+        )
+        return self.get_paginated_response(serializer.data)
+
+    @action(methods=['get'],
+            url_path='pantry',
+            url_name='pantry',
+            permission_classes=[AllowAny],
+            pagination_class=PantryPagination,
+            detail=False)
+    def pantry(self, request):
+        params = PantrySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        data = params.validated_data
+        index = pantry.get_index()
+        if index is None:
+            raise PantryIndexNotReady
+        ranking = index.rank(
+            data['ingredients'],
+            any_tags=sum(tag.mask for tag in data.get('tags', ())),
+            all_tags=sum(tag.mask for tag in data.get('tags_all', ())),
+            max_cooking_time=data.get('cooking_time'),
+        )
+        recipe_ids = [match[-1] for match in self.paginate_queryset(ranking)]
+        recipes = Recipe.objects.with_related(request.user).in_bulk(
+            recipe_ids
+        )
+        serializer = PantryRecipeSerializer(
+            [recipes[pk] for pk in recipe_ids if pk in recipes],
+            many=True,
+            context={
+                **self.get_serializer_context(),
+                'pantry': set(data['ingredients']),
+            },
+        )
+        return self.get_paginated_response(serializer.data)
+
+    @action(methods=['get'],
+            url_path=r'(?P<recipe_id>\d+)/similar',
+            url_name='similar',
+            permission_classes=[AllowAny],
+            detail=False)
+    def similar(self, request, recipe_id):
+        get_object_or_404(Recipe.objects.only('id'), id=recipe_id)
+        limit = min(
+            get_limit(request, settings.SIMILAR_RECIPES_COUNT),
+            settings.SIMILAR_RECIPES_COUNT,
+        )
+        recipe_ids = similar.similar_recipe_ids(recipe_id, limit)
+        recipes = Recipe.objects.with_related(request.user).in_bulk(
+            recipe_ids
+        )
+        serializer = RecipeReadSerializer(
+            [recipes[pk] for pk in recipe_ids if pk in recipes],
+            many=True,
+            context=self.get_serializer_context(),
+        )
+        return Response(serializer.data)
+
     @action(methods=['get'],
             url_path=r'(?P<recipe_id>\d+)/get-link',
             url_name='get-link',
             permission_classes=[AllowAny],
             detail=False)
     def get_link(self, request, recipe_id):
-        recipe = Recipe.objects.get(id=recipe_id)
-        short_link = recipe.short_link
-        response = JsonResponse({
-            'short-link': f'{short_link}',
+        recipe = get_object_or_404(
+            Recipe.objects.only('id', 'short_code'), id=recipe_id
+        )
+        short_links.remember(recipe.short_code, recipe.id)
+        return JsonResponse({
+            'short-link': request.build_absolute_uri(
+                reverse('short-link', args=[recipe.short_code])
+            ),
         })
-        return response
 
     @action(methods=['post', 'delete'],
             url_path=r'(?P<recipe_id>\d+)/favorite',
@@ -89,22 +246,9 @@ class RecipeViewSet(viewsets.ModelViewSet):
             permission_classes=[IsAuthenticated],
             detail=False)
     def favorite(self, request, recipe_id):
-        user = self.request.user
-        recipe = get_object_or_404(Recipe, id=recipe_id)
-        if request.method == 'POST':
-            if Favorite.objects.filter(user=user, recipe=recipe).exists():
-                return Response(status=status.HTTP_400_BAD_REQUEST)
-            favorite = Favorite.objects.create(user=user, recipe=recipe)
-            serializer = FavoriteSerializer(favorite, data=request.data)
-            serializer.is_valid(raise_exception=True)
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        if request.method == 'DELETE':
-            if Favorite.objects.filter(user=user, recipe=recipe).exists():
-                favorite = Favorite.objects.get(user=user, recipe=recipe)
-                favorite.delete()
-                return Response(status=status.HTTP_204_NO_CONTENT)
-            return Response(status=status.HTTP_400_BAD_REQUEST)
+        return self.toggle_recipe(
+            request, recipe_id, Favorite, FavoriteSerializer
+        )
 
     @action(methods=['post', 'delete'],
             url_path=r'(?P<recipe_id>\d+)/shopping_cart',
@@ -112,49 +256,79 @@ class RecipeViewSet(viewsets.ModelViewSet):
             permission_classes=[IsAuthenticated],
             detail=False)
     def shopping_cart(self, request, recipe_id):
-        user = self.request.user
+        return self.toggle_recipe(
+            request, recipe_id, ShoppingCart, ShoppingCartSerializer
+        )
+
+    def toggle_recipe(self, request, recipe_id, model, serializer_class):
         recipe = get_object_or_404(Recipe, id=recipe_id)
+        relation = model(user=request.user, recipe=recipe)
         if request.method == 'POST':
-            if ShoppingCart.objects.filter(
-                user=user, recipe=recipe
-            ).exists():
+            if not services.link(relation):
                 return Response(status=status.HTTP_400_BAD_REQUEST)
-            sh_cart = ShoppingCart.objects.create(user=user, recipe=recipe)
-            serializer = ShoppingCartSerializer(sh_cart, data=request.data)
-            serializer.is_valid(raise_exception=True)
-            serializer.save()
+            serializer = serializer_class(relation)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
-        if request.method == 'DELETE':
-            if ShoppingCart.objects.filter(
-                user=user, recipe=recipe
-            ).exists():
-                sh_cart = ShoppingCart.objects.get(
-                    user=user, recipe=recipe
-                )
-                sh_cart.delete()
-                return Response(status=status.HTTP_204_NO_CONTENT)
+        if not services.unlink(relation):
             return Response(status=status.HTTP_400_BAD_REQUEST)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    def change_recipes(self, request, model):
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        change = (
+            services.add_recipes if request.method == 'POST'
+            else services.remove_recipes
+        )
+        results = change(model, request.user, serializer.validated_data['ids'])
+        return Response({'results': [
+            {'id': pk, 'status': result} for pk, result in results.items()
+        ]})
+
+    @action(methods=['post', 'delete'],
+            url_path='favorite',
+            url_name='favorite-batch',
+            permission_classes=[IsAuthenticated],
+            detail=False)
+    def favorite_batch(self, request):
+        return self.change_recipes(request, Favorite)
+
+    @action(methods=['post', 'delete'],
+            url_path='shopping_cart',
+            url_name='shopping_cart-batch',
+            permission_classes=[IsAuthenticated],
+            detail=False)
+    def shopping_cart_batch(self, request):
+        return self.change_recipes(request, ShoppingCart)
 
     @action(methods=['get'],
             url_path='download_shopping_cart',
             url_name='download_shopping_cart',
             permission_classes=[IsAuthenticated],
+            content_negotiation_class=FileDownloadNegotiation,
             detail=False)
     def download_shopping_cart(self, request):
         user = self.request.user
-        ingredients = IngredientAmount.objects.filter(
-            recipe__shopping_cart__user=user
-        ).values('ingredient__name', 'ingredient__measurement_unit').annotate(
-            amount=Sum('amount')
-        )
-        list_for_sh = ['Список покупок\n']
-        for ingredient in ingredients:
-            name = ingredient['ingredient__name']
-            amount = ingredient['amount']
-            unit = ingredient['ingredient__measurement_unit']
-            list_for_sh += [
-                f'{name} {amount} {unit}\n'
-            ]
-        return FileResponse(
-            list_for_sh, as_attachment=True, filename="Shopping-list.txt"
-        )
+        export_format = request.query_params.get('format', 'txt')
+        if export_format not in shopping_list.FORMATS:
+            raise ValidationError({'format': 'Доступные форматы: {}'.format(
+                ', '.join(shopping_list.FORMATS)
+            )})
+        etag = shopping_list.get_etag(user, export_format)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            try:
+                response = shopping_list.export(user, export_format)
+            except OSError:
+                raise ValidationError(
+                    {'format': f'Формат {export_format} недоступен'}
+                )
+        response['ETag'] = etag
+        patch_cache_control(response, no_cache=True, private=True)
+        return response
+
+
+def short_link_redirect(request, code):
+    recipe_id = short_links.resolve(code)
+    if recipe_id is None:
+        raise Http404('Ссылка не найдена')
+    return HttpResponseRedirect(f'/recipes/{recipe_id}')
@@ -0,0 +1,49 @@
+# Generated by Django 3.2.16 on 2026-10-18 04:56
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+    for field, model_name, field_name in (
+        ('recipes_count', 'Recipe', 'author'),
+        ('followers_count', 'Follow', 'following'),
+        ('following_count', 'Follow', 'user'),
+    ):
+        related = apps.get_model('recipe', model_name)
+        User.objects.update(**{field: Coalesce(Subquery(
+            related.objects.filter(
+                **{field_name: OuterRef('pk')}
+            ).order_by().values(field_name).annotate(
+                total=Count('pk')
+            ).values('total')
+        ), 0)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_alter_user_username'),
+        ('recipe', '0003_auto_20241010_0139'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='followers_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество подписчиков'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='following_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество подписок'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='recipes_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество рецептов'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
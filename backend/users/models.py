@@ -43,6 +43,27 @@ class User(AbstractUser):
         blank=True,
         null=True
     )
+    avatar_variants = models.JSONField(
+        'Варианты аватара',
+        default=dict,
+        blank=True,
+        editable=False,
+    )
+    recipes_count = models.PositiveIntegerField(
+        'Количество рецептов',
+        default=0,
+        editable=False,
+    )
+    followers_count = models.PositiveIntegerField(
+        'Количество подписчиков',
+        default=0,
+        editable=False,
+    )
+    following_count = models.PositiveIntegerField(
+        'Количество подписок',
+        default=0,
+        editable=False,
+    )
 
     class Meta:
         default_related_name = 'users'
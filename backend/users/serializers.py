@@ -1,7 +1,7 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from recipe.models import Follow, Recipe
-from api.utils import Base64ImageField
+from api.utils import Base64ImageField, ImageVariantsField
 
 
 User = get_user_model()
@@ -11,6 +11,7 @@ class UserListSerializer(serializers.ModelSerializer):
     avatar = serializers.SerializerMethodField(
         'get_image_url', read_only=True,
     )
+    avatar_images = ImageVariantsField('avatar')
 
     class Meta:
         model = User
@@ -21,6 +22,7 @@ class UserListSerializer(serializers.ModelSerializer):
             'last_name',
             'email',
             'avatar',
+            'avatar_images',
         )
 
     def get_image_url(self, obj):
@@ -41,6 +43,7 @@ class UserSerializer(UserListSerializer):
             'last_name',
             'email',
             'avatar',
+            'avatar_images',
             'is_subscribed'
         )
 
@@ -48,6 +51,8 @@ class UserSerializer(UserListSerializer):
         user = self.context['request'].user
         if user.is_anonymous:
             return False
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         return Follow.objects.filter(user=user, following=obj).exists()
 
     def validate_username(self, value):
@@ -66,6 +71,7 @@ class AvatarSerializer(serializers.ModelSerializer):
 
 class SubscriptionsRecipeSerializer(serializers.ModelSerializer):
     image = serializers.SerializerMethodField('get_image_url',)
+    images = ImageVariantsField()
 
     class Meta:
         model = Recipe
@@ -73,6 +79,7 @@ class SubscriptionsRecipeSerializer(serializers.ModelSerializer):
             'id',
             'name',
             'image',
+            'images',
             'cooking_time',
         )
 
@@ -90,6 +97,7 @@ class SubscriptionsSerializer(serializers.ModelSerializer):
     email = serializers.ReadOnlyField(source='following.email')
     avatar = serializers.SerializerMethodField(
         'get_avatar_url', source='following.avatar')
+    avatar_images = ImageVariantsField('avatar', source='following')
     is_subscribed = serializers.SerializerMethodField('get_is_subscribed')
     recipes_count = serializers.SerializerMethodField('get_recipes_count')
     recipes = serializers.SerializerMethodField('get_recipe')
@@ -103,26 +111,23 @@ class SubscriptionsSerializer(serializers.ModelSerializer):
             'last_name',
             'email',
             'avatar',
+            'avatar_images',
             'is_subscribed',
             'recipes_count',
             'recipes',
         )
 
     def get_is_subscribed(self, obj):
-        return Follow.objects.filter(
-            user=obj.user, following=obj.following
-        ).exists()
+        return obj.user_id == self.context['request'].user.id
 
     def get_recipes_count(self, obj):
-        recipes = Recipe.objects.filter(author=obj.following)
-        num = recipes.count()
-        return num
+        return obj.following.recipes_count
 
     def get_recipe(self, obj):
-        limit = self.context['request'].GET.get('recipes_limit')
-        recipes = Recipe.objects.filter(author=obj.following)
-        if limit:
-            recipes = recipes[:int(limit)]
+        recipes = getattr(obj, 'latest_recipes', None)
+        if recipes is None:
+            limit = self.context.get('recipes_limit')
+            recipes = Recipe.objects.filter(author=obj.following)[:limit]
         return SubscriptionsRecipeSerializer(
             recipes, read_only=True, many=True
         ).data
@@ -2,11 +2,15 @@ from djoser import views as djoser_views
 from django.shortcuts import get_object_or_404
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
-from rest_framework.pagination import LimitOffsetPagination
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import JSONParser, MultiPartParser
 from django.contrib.auth import get_user_model
-from recipe.models import Follow
+from api.cache import ConditionalGetMixin
+from api.pagination import KeysetPagination
+from recipe import feed, services
+from recipe.models import Follow, Recipe
 from users.serializers import (
     UserSerializer,
     AvatarSerializer,
@@ -18,9 +22,27 @@ from users.serializers import (
 User = get_user_model()
 
 
-class UserViewSet(djoser_views.UserViewSet):
-    queryset = User.objects.all()
+def get_recipes_limit(request):
+    limit = request.query_params.get('recipes_limit')
+    if not limit:
+        return None
+    if not limit.isdigit():
+        raise ValidationError(
+            {'recipes_limit': 'Должно быть неотрицательным целым числом'}
+        )
+    return int(limit)
+
+
+class UserViewSet(ConditionalGetMixin, djoser_views.UserViewSet):
+    queryset = User.objects.order_by('id')
     serializer_class = UserSerializer
+    pagination_class = KeysetPagination
+    cache_scopes = ('authors',)
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return UserListSerializer
+        return super().get_serializer_class()
 
     @action(methods=['get'],
             permission_classes=[IsAuthenticated],
@@ -34,6 +56,7 @@ class UserViewSet(djoser_views.UserViewSet):
             url_path='me/avatar',
             url_name='avatar',
             permission_classes=[IsAuthenticated],
+            parser_classes=[JSONParser, MultiPartParser],
             detail=False)
     def avatar(self, request):
         user = self.request.user
@@ -49,14 +72,6 @@ class UserViewSet(djoser_views.UserViewSet):
             user.avatar.delete()
             return Response(status=status.HTTP_204_NO_CONTENT)
 
-    def list(self, request):
-        queryset = User.objects.all()
-        paginator = LimitOffsetPagination()
-        paginator.page_size = 5
-        result_page = paginator.paginate_queryset(queryset, request)
-        serializer = UserListSerializer(result_page, many=True)
-        return paginator.get_paginated_response(serializer.data)
-
     @action(methods=['get'],
             url_path='subscriptions',
             url_name='subscriptions',
@@ -64,14 +79,22 @@ class UserViewSet(djoser_views.UserViewSet):
             detail=False)
     def subscriptions(self, request):
         user = self.request.user
-        following = Follow.objects.filter(user=user)
-        paginator = LimitOffsetPagination()
-        paginator.page_size = 5
-        result_page = paginator.paginate_queryset(following, request)
+        following = Follow.objects.filter(user=user).select_related(
+            'following'
+        ).order_by('id')
+        result_page = self.paginate_queryset(following)
+        recipes_limit = get_recipes_limit(request)
+        recipes = Recipe.objects.latest_by_author(
+            [follow.following_id for follow in result_page], recipes_limit
+        )
+        for follow in result_page:
+            follow.latest_recipes = recipes[follow.following_id]
         serializer = SubscriptionsSerializer(
-            result_page, many=True, context={'request': request}
+            result_page,
+            many=True,
+            context={'request': request, 'recipes_limit': recipes_limit}
         )
-        return paginator.get_paginated_response(serializer.data)
+        return self.get_paginated_response(serializer.data)
 
     @action(methods=['post', 'delete'],
             url_path=r'(?P<user_id>\d+)/subscribe',
@@ -81,21 +104,22 @@ class UserViewSet(djoser_views.UserViewSet):
     def subscribe(self, request, user_id):
         user = self.request.user
         following = get_object_or_404(User, id=user_id)
+        follow = Follow(user=user, following=following)
         if request.method == 'POST':
-            if Follow.objects.filter(user=user, following=following).exists():
-                return Response(status=status.HTTP_400_BAD_REQUEST)
-            if user == following:
+            if user == following or not services.link(follow):
                 return Response(status=status.HTTP_400_BAD_REQUEST)
+            feed.backfill.delay(user.pk, following.pk)
             serializer = SubscriptionsSerializer(
-                data=request.data,
-                context={'request': request, 'following': following}
+                follow,
+                context={
+                    'request': request,
+                    'recipes_limit': get_recipes_limit(request),
+                }
             )
-            serializer.is_valid(raise_exception=True)
-            serializer.save(user=user, following=following)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         if request.method == 'DELETE':
-            if Follow.objects.filter(user=user, following=following).exists():
-                follow = Follow.objects.get(user=user, following=following)
-                follow.delete()
-                return Response(status=status.HTTP_204_NO_CONTENT)
-            return Response(status=status.HTTP_400_BAD_REQUEST)
+            if not services.unlink(follow):
+                return Response(status=status.HTTP_400_BAD_REQUEST)
+            feed.remove_author(user.pk, following.pk)
+            feed.follower_removed(following.pk)
+            return Response(status=status.HTTP_204_NO_CONTENT)